@@ -0,0 +1,61 @@
+"""
+Microbenchmark of the login form parser engines.
+
+Usage:
+    python -m bench.form_parser [--number N]
+"""
+
+import argparse
+import timeit
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, Tuple
+
+from handlers.portal_handler import PortalHandler
+
+PAGES_PATH = Path(__file__).resolve().parent / "pages"
+
+ENGINES: Dict[str, Callable[[str], Tuple[str, Dict[str, str]]]] = {
+    "stream": PortalHandler.parse_login_form_stream,
+    "bs4": PortalHandler.parse_login_form_bs4,
+}
+
+
+def load_pages() -> Dict[str, str]:
+    pages = {path.stem: path.read_text() for path in sorted(PAGES_PATH.glob("*.html"))}
+    # Portals often pad the page with notices and scripts after the form
+    filler = "<p>Acceptable use policy. " + "Lorem ipsum dolor sit amet. " * 20 + "</p>\n"
+    for name, html in list(pages.items()):
+        pages[f"{name}+200KB"] = html.replace("</body>", filler * 350 + "</body>")
+    return pages
+
+
+def peak_memory(parse: Callable[[str], object], html: str) -> int:
+    tracemalloc.start()
+    parse(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=200, help="Parses per timing.")
+    args = parser.parse_args()
+
+    print(f"{'page':<28} {'engine':<8} {'us/parse':>10} {'peak KiB':>10}")
+    for name, html in load_pages().items():
+        results = {engine: parse(html) for engine, parse in ENGINES.items()}
+        assert results["stream"] == results["bs4"], f"Engines disagree on {name}"
+        for engine, parse in ENGINES.items():
+            seconds = min(
+                timeit.repeat(lambda: parse(html), number=args.number, repeat=3)
+            )
+            print(
+                f"{name:<28} {engine:<8} {seconds / args.number * 1e6:>10.1f}"
+                f" {peak_memory(parse, html) / 1024:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Local stand-in for the IIITK FortiGate captive portal.
+
+Usage:
+    python -m bench.mock_portal [--port N] [--latency S] [--jitter S] [--failure-rate P]
+"""
+
+import argparse
+import random
+import secrets
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+LOGIN_PAGE = (Path(__file__).resolve().parent / "pages" / "fortigate_login.html").read_text()
+
+REDIRECT_PAGE = """<html><body><script language="JavaScript">
+window.location="{url}";
+</script></body></html>"""
+
+KEEPALIVE_PAGE = """<html><head><title>Firewall Authentication Keepalive Window</title></head>
+<body><p>This browser window is used to keep your authentication session active.</p>
+<p>Authentication Refresh in <b id="countDown">{lifetime}</b> seconds</p>
+<p><a href="http://{host}/keepalive?{token}">keepalive</a>
+<a href="http://{host}/logout?{token}">logout</a></p>
+<script>setTimeout(function () {{ window.location="http://{host}/keepalive?{token}"; }}, 1000);</script>
+</body></html>"""
+
+FAILED_PAGE = """<html><body><h1>Authentication Failed</h1>
+<p>Please check your credentials.</p></body></html>"""
+
+LOGOUT_PAGE = "<html><body><p>You have logged out.</p></body></html>"
+
+
+class MockPortal:
+    """
+    Serves the probe redirect, the login form, the login POST with its
+    "Authentication Failed" answer, and the keepalive and logout urls.
+    """
+
+    def __init__(
+        self,
+        port: int = 0,
+        username: str = "user",
+        password: str = "pass",
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        session_lifetime: float = 0.0,
+        session_limit: float = 0.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.session_lifetime = session_lifetime  # 0 keeps sessions forever
+        self.session_limit = session_limit  # 0 lets keepalives extend sessions forever
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests: Counter = Counter()
+        self.magics: set = set()
+        self.token: Optional[str] = None
+        self.authenticated_at: Optional[float] = None
+        self.logged_in_at: Optional[float] = None
+        self.logins = 0
+
+        portal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                portal.handle(self, "GET")
+
+            def do_POST(self) -> None:
+                portal.handle(self, "POST")
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        return f"127.0.0.1:{self.server.server_address[1]}"
+
+    @property
+    def probe_url(self) -> str:
+        return f"http://{self.host}/generate_204"
+
+    def start(self) -> "MockPortal":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def authenticated(self) -> bool:
+        with self.lock:
+            if self.authenticated_at is None:
+                return False
+            now = monotonic()
+            if (
+                self.session_lifetime
+                and now - self.authenticated_at > self.session_lifetime
+                or self.session_limit
+                and now - self.logged_in_at > self.session_limit
+            ):
+                self.authenticated_at = None
+                self.token = None
+                return False
+            return True
+
+    def expire(self) -> None:
+        with self.lock:
+            self.authenticated_at = None
+            self.token = None
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str) -> None:
+        url = urlsplit(request.path)
+        with self.lock:
+            self.requests[f"{method} {url.path}"] += 1
+        sleep(self.latency + self.rng.uniform(0, self.jitter))
+        if self.rng.random() < self.failure_rate:
+            self.respond(request, 503, "<html><body>Service Unavailable</body></html>")
+            return
+
+        if method == "POST":
+            length = int(request.headers.get("Content-Length", 0))
+            form = parse_qs(request.rfile.read(length).decode())
+            self.login(request, {key: values[0] for key, values in form.items()})
+        elif url.path == "/fgtauth":
+            with self.lock:
+                valid = url.query in self.magics
+            if not valid:
+                self.respond(request, 404, "<html><body>Not Found</body></html>")
+                return
+            page = LOGIN_PAGE.replace("0e0c1b6a2d3f4e58", url.query)
+            self.respond(request, 200, page)
+        elif url.path == "/keepalive":
+            if self.authenticated() and url.query == self.token:
+                with self.lock:
+                    self.authenticated_at = monotonic()
+                self.respond(request, 200, self.keepalive_page())
+            else:
+                self.respond(request, 200, self.redirect_page())
+        elif url.path == "/logout":
+            if url.query == self.token:
+                self.expire()
+            self.respond(request, 200, LOGOUT_PAGE)
+        elif self.authenticated():
+            self.respond(request, 204, "")
+        else:
+            self.respond(request, 200, self.redirect_page())
+
+    def login(self, request: BaseHTTPRequestHandler, form: dict) -> None:
+        with self.lock:
+            valid_magic = form.get("magic") in self.magics
+            if valid_magic:
+                self.magics.discard(form["magic"])
+        if not valid_magic:
+            self.respond(request, 200, self.redirect_page())
+            return
+        if form.get("username") != self.username or form.get("password") != self.password:
+            self.respond(request, 200, FAILED_PAGE)
+            return
+        with self.lock:
+            self.token = secrets.token_hex(8)
+            self.authenticated_at = self.logged_in_at = monotonic()
+            self.logins += 1
+        self.respond(request, 200, self.keepalive_page())
+
+    def redirect_page(self) -> str:
+        magic = secrets.token_hex(8)
+        with self.lock:
+            self.magics.add(magic)
+        return REDIRECT_PAGE.format(url=f"http://{self.host}/fgtauth?{magic}")
+
+    def keepalive_page(self) -> str:
+        return KEEPALIVE_PAGE.format(
+            host=self.host, token=self.token, lifetime=int(self.session_lifetime)
+        )
+
+    @staticmethod
+    def respond(request: BaseHTTPRequestHandler, status: int, body: str) -> None:
+        data = body.encode()
+        request.send_response(status)
+        if status != 204:
+            request.send_header("Content-Type", "text/html; charset=utf-8")
+            request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        if status != 204:
+            request.wfile.write(data)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--username", default="user")
+    parser.add_argument("--password", default="pass")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per request.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random seconds.")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of 503s.")
+    parser.add_argument("--session-lifetime", type=float, default=0.0, help="Seconds.")
+    parser.add_argument(
+        "--session-limit", type=float, default=0.0, help="Seconds, despite keepalives."
+    )
+    args = parser.parse_args()
+
+    portal = MockPortal(
+        args.port,
+        args.username,
+        args.password,
+        args.latency,
+        args.jitter,
+        args.failure_rate,
+        args.session_lifetime,
+        args.session_limit,
+    )
+    print(f"Mock portal listening, probe url: {portal.probe_url}")
+    try:
+        portal.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
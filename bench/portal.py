@@ -0,0 +1,199 @@
+"""
+End-to-end benchmarks against the mock captive portal.
+
+Usage:
+    python -m bench.portal login [--runs N] [--latency S] [--jitter S] [--failure-rate P]
+    python -m bench.portal daemon [--duration S] [--expire-every S] [--keepalive-interval S]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from statistics import median, quantiles
+from time import monotonic, perf_counter, sleep
+from pathlib import Path
+from typing import List, Tuple
+
+from bench.mock_portal import MockPortal
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+REPO_PATH = Path(__file__).resolve().parent.parent
+
+
+def summary(samples: List[float]) -> str:
+    if not samples:
+        return "no samples"
+    p95 = quantiles(samples, n=20)[-1] if len(samples) > 1 else samples[0]
+    return f"p50 {median(samples) * 1e3:.1f}ms  p95 {p95 * 1e3:.1f}ms  n={len(samples)}"
+
+
+def setup(portal: MockPortal, keepalive_interval: float = 240) -> None:
+    """Points the loginator at the mock portal. HOME must already be a scratch dir."""
+    import config
+
+    config.ANDROID = True
+    config.PROBE_URLS[:] = [portal.probe_url]
+    config.KEEPALIVE_INTERVAL = keepalive_interval
+
+    from handlers.secret_handler import SecretHandlerPlainText
+
+    SecretHandlerPlainText.store_user_credentials(portal.username, portal.password)
+
+
+def bench_login(args: argparse.Namespace) -> None:
+    portal = MockPortal(
+        latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate, seed=0
+    ).start()
+    setup(portal)
+
+    from config import FORM_CACHE_FILE
+    from handlers.form_handler import FormCacheHandler
+    from handlers.http_handler import HttpHandler
+    from handlers.session_handler import LoginResult, SessionHandler
+
+    for mode in ("cold", "warm"):
+        durations: List[float] = []
+        requests: List[int] = []
+        failures = 0
+        for _ in range(args.runs):
+            portal.expire()
+            if mode == "cold":
+                HttpHandler.reset()
+                FormCacheHandler.TEMPLATES = None
+                FORM_CACHE_FILE.unlink(missing_ok=True)
+            before = sum(portal.requests.values())
+            start = perf_counter()
+            result = SessionHandler.login(username=None, password=None)
+            if result != LoginResult.LOGGED_IN or not portal.authenticated():
+                failures += 1
+                continue
+            durations.append(perf_counter() - start)
+            requests.append(sum(portal.requests.values()) - before)
+        per_login = sum(requests) / len(requests) if requests else 0
+        print(
+            f"{mode:<5} time-to-online {summary(durations)}"
+            f"  requests/login {per_login:.1f}  failed {failures}"
+        )
+    portal.stop()
+
+
+def bench_daemon_worker(args: argparse.Namespace) -> None:
+    """Runs the daemon in this process, against the portal at args.probe_url."""
+    import config
+
+    config.ANDROID = True
+    config.PROBE_URLS[:] = [args.probe_url]
+    config.KEEPALIVE_INTERVAL = args.keepalive_interval
+
+    from cli.main import cli
+
+    cli(["--android", "run"])
+
+
+def sample_process(pid: int) -> Tuple[float, int]:
+    """
+    Returns:
+        The CPU seconds used so far and the resident set size in KiB.
+    """
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    rss = 0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+    return cpu, rss
+
+
+def bench_daemon(args: argparse.Namespace) -> None:
+    portal = MockPortal(latency=args.latency, jitter=args.jitter, seed=0).start()
+    setup(portal)
+
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "bench.portal",
+            "daemon-worker",
+            "--probe-url",
+            portal.probe_url,
+            "--keepalive-interval",
+            str(args.keepalive_interval),
+        ],
+        cwd=REPO_PATH,
+        env=os.environ,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    start = monotonic()
+    expired_at = None
+    next_expiry = start + args.expire_every
+    outages: List[float] = []
+    rss_samples: List[int] = []
+    try:
+        while monotonic() - start < args.duration:
+            sleep(0.05)
+            now = monotonic()
+            if expired_at is None and now >= next_expiry and portal.authenticated():
+                portal.expire()
+                expired_at = now
+            elif expired_at is not None and portal.authenticated():
+                outages.append(now - expired_at)
+                expired_at = None
+                next_expiry = now + args.expire_every
+            if int(now * 20) % 20 == 0:
+                rss_samples.append(sample_process(process.pid)[1])
+        cpu, rss = sample_process(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+        portal.stop()
+
+    elapsed = monotonic() - start
+    print(f"duration         {elapsed:.0f}s, logins {portal.logins}")
+    print(f"time-to-online   {summary(outages)} (after a forced session expiry)")
+    print(f"requests/minute  {sum(portal.requests.values()) / elapsed * 60:.1f}")
+    print(f"cpu              {cpu:.2f}s ({cpu / elapsed * 100:.2f}%)")
+    print(f"rss              final {rss} KiB, max {max(rss_samples, default=rss)} KiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    login = commands.add_parser("login", help="Time-to-online and requests per login.")
+    login.add_argument("--runs", type=int, default=50)
+
+    daemon = commands.add_parser("daemon", help="Long running daemon cost.")
+    daemon.add_argument("--duration", type=float, default=60, help="Seconds.")
+    daemon.add_argument("--expire-every", type=float, default=10, help="Seconds.")
+    daemon.add_argument("--keepalive-interval", type=float, default=2, help="Seconds.")
+
+    for command in (login, daemon):
+        command.add_argument("--latency", type=float, default=0.0)
+        command.add_argument("--jitter", type=float, default=0.0)
+    login.add_argument("--failure-rate", type=float, default=0.0)
+
+    worker = commands.add_parser("daemon-worker")
+    worker.add_argument("--probe-url", required=True)
+    worker.add_argument("--keepalive-interval", type=float, required=True)
+
+    args = parser.parse_args()
+    if args.command == "daemon-worker":
+        bench_daemon_worker(args)
+        return
+
+    with tempfile.TemporaryDirectory() as home:
+        # Keeps the token, credentials and cache files away from the real ones
+        os.environ["HOME"] = home
+        if args.command == "login":
+            bench_login(args)
+        else:
+            bench_daemon(args)
+
+
+if __name__ == "__main__":
+    main()
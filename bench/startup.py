@@ -0,0 +1,84 @@
+"""
+Cold start benchmark of the CLI commands, based on `python -X importtime`.
+
+Usage:
+    python -m bench.startup [--runs N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Set, Tuple
+
+SCRIPT_PATH = Path(__file__).resolve().parent.parent / "loginator.py"
+
+# Commands that are cheap to run without side effects in an empty home
+COMMANDS: List[List[str]] = [
+    ["--help"],
+    ["get", "ip"],
+    ["get", "token"],
+    ["service", "status"],
+    ["--android", "credentials", "list"],
+    ["logout"],
+]
+
+HEAVY_MODULES = ["requests", "bs4", "pyperclip", "secretstorage"]
+
+
+def run_command(args: List[str], home: str) -> Tuple[float, Dict[str, int], Set[str]]:
+    """
+    Returns:
+        The wall time in seconds, the cumulative import time of each top
+        level module in microseconds and the names of all imported modules.
+    Raises:
+        RuntimeError: If the command fails, as its timing would be meaningless.
+    """
+    start = perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", str(SCRIPT_PATH), *args],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "HOME": home},
+    )
+    elapsed = perf_counter() - start
+    if result.returncode != 0:
+        last_line = result.stderr.strip().splitlines()[-1:] or ["no output"]
+        raise RuntimeError(
+            f"{' '.join(args)} exited with {result.returncode}: {last_line[0]}"
+        )
+
+    imports: Dict[str, int] = {}
+    modules: Set[str] = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        modules.add(name.strip())
+        if not name.startswith("  "):  # only top level imports
+            imports[name.strip()] = int(cumulative)
+    return elapsed, imports, modules
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5, help="Runs per command.")
+    args = parser.parse_args()
+
+    print(f"{'command':<36} {'wall ms':>8} {'import ms':>10}  heavy modules")
+    with tempfile.TemporaryDirectory() as home:
+        for command in COMMANDS:
+            runs = [run_command(command, home) for _ in range(args.runs)]
+            elapsed, imports, modules = min(runs, key=lambda run: run[0])
+            heavy = [name for name in HEAVY_MODULES if name in modules]
+            print(
+                f"{' '.join(command):<36} {elapsed * 1e3:>8.1f}"
+                f" {sum(imports.values()) / 1e3:>10.1f}  {', '.join(heavy) or '-'}"
+            )
+
+
+if __name__ == "__main__":
+    main()
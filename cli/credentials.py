@@ -1,5 +1,4 @@
 import click
-import pyperclip
 
 from handlers.secret_handler import get_secret_handler
 
@@ -59,6 +58,8 @@ def list():
 @credentials.command()
 def copy():
     """Copy user credentials to clipboard."""
+    import pyperclip
+
     username = click.prompt("Enter the username to retrieve credentials", type=str)
     try:
         _, password = get_secret_handler().get_user_credentials(username)
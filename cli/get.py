@@ -1,21 +1,52 @@
+import json
+from datetime import datetime
 import click
-import pyperclip
+from logging import error
 
+from typing import Optional, Tuple
+
+from handlers.control_handler import ControlHandler
+from handlers.link_handler import LinkHandler
+from handlers.metrics_handler import MetricsHandler
 from handlers.session_handler import SessionHandler
 
 
+def get_session_details(link: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Asks the run service for the session details of an interface, falling
+    back to reading them.
+    Raises:
+        ValueError: If no session token is found.
+    """
+    try:
+        response = ControlHandler.request("session", link=link)
+    except ValueError as e:
+        error(e)
+        raise e
+    if response is None:
+        with LinkHandler.use(link):
+            return SessionHandler.get_session_details()
+    ip, token = response["result"]
+    return ip, token
+
+
 # Session Details Commands
 @click.group()
-def get():
+@click.option("--interface", "link", help="Get the session of this interface.")
+@click.pass_context
+def get(ctx: click.Context, link: Optional[str]):
     """Get session details."""
-    pass
+    ctx.obj = link
 
 
 @get.command()
-def token():
+@click.pass_obj
+def token(link: Optional[str]):
     """Get the session token."""
+    import pyperclip
+
     try:
-        _, token = SessionHandler.get_session_details()
+        _, token = get_session_details(link)
         click.echo(f"Session Token: {token}")
         pyperclip.copy(token)
         click.echo("Token copied to clipboard.")
@@ -24,10 +55,13 @@ def token():
 
 
 @get.command()
-def ip():
+@click.pass_obj
+def ip(link: Optional[str]):
     """Get the session IP address."""
+    import pyperclip
+
     try:
-        ip, _ = SessionHandler.get_session_details()
+        ip, _ = get_session_details(link)
         click.echo(f"Session IP: {ip}")
         pyperclip.copy(ip)
         click.echo("IP copied to clipboard.")
@@ -36,10 +70,13 @@ def ip():
 
 
 @get.command()
-def keepalive_url():
+@click.pass_obj
+def keepalive_url(link: Optional[str]):
     """Get the keepalive URL."""
+    import pyperclip
+
     try:
-        ip, token = SessionHandler.get_session_details()
+        ip, token = get_session_details(link)
         url = f"http://{ip}/keepalive?{token}"
         click.echo(f"Keepalive URL: {url}")
         pyperclip.copy(url)
@@ -49,13 +86,197 @@ def keepalive_url():
 
 
 @get.command()
-def logout_url():
+@click.pass_obj
+def logout_url(link: Optional[str]):
     """Get the logout URL."""
+    import pyperclip
+
     try:
-        ip, token = SessionHandler.get_session_details()
+        ip, token = get_session_details(link)
         url = f"http://{ip}/logout?{token}"
         click.echo(f"Logout URL: {url}")
         pyperclip.copy(url)
         click.echo("Logout URL copied to clipboard.")
     except ValueError:
         pass
+
+
+@get.command()
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["table", "json", "prometheus"]),
+    default="table",
+    help="Output format.",
+)
+def stats(output_format: str):
+    """Get the login latency statistics of the run service."""
+    try:
+        histograms = MetricsHandler.load()
+    except ValueError as e:
+        error(e)
+        return
+
+    if output_format == "json":
+        click.echo(
+            json.dumps({name: h.to_dict() for name, h in histograms.items()}, indent=2)
+        )
+    elif output_format == "prometheus":
+        click.echo(MetricsHandler.render_prometheus(histograms), nl=False)
+    else:
+        click.echo(f"{'phase':<18} {'count':>6} {'p50':>8} {'p95':>8} {'mean':>8}")
+        for name, histogram in sorted(histograms.items()):
+            p50, p95 = histogram.percentile(50), histogram.percentile(95)
+            mean = histogram.sum / histogram.count if histogram.count else 0
+            click.echo(
+                f"{name:<18} {histogram.count:>6} {p50 or 0:>7.3f}s"
+                f" {p95 or 0:>7.3f}s {mean:>7.3f}s"
+            )
+
+
+@get.command()
+@click.option("--json", "as_json", is_flag=True, help="Output as JSON.")
+@click.pass_obj
+def prediction(link: Optional[str], as_json: bool):
+    """Get the predicted session lifetime and expiry."""
+    try:
+        response = ControlHandler.request("prediction", link=link)
+    except ValueError as e:
+        error(e)
+        return
+    if response is not None:
+        result = response["result"]
+    else:
+        from handlers.journal_handler import JournalHandler
+        from handlers.prediction_handler import SessionPredictor
+
+        JournalHandler.load()
+        with LinkHandler.use(link):
+            result = SessionPredictor.as_dict()
+
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+        return
+    if result is None:
+        click.echo("No session has ended yet, nothing to predict from.")
+        return
+    click.echo(f"Session lifetime: {result['lifetime']:.0f}s")
+    click.echo(f"Confidence: {result['confidence']:.2f} ({result['samples']} sessions)")
+    if result["expires_at"] is not None:
+        expires_at = datetime.fromtimestamp(result["expires_at"])
+        click.echo(f"Current session expires: {expires_at:%Y-%m-%d %H:%M:%S}")
+
+
+@get.command()
+@click.option("--json", "as_json", is_flag=True, help="Output as JSON.")
+@click.pass_obj
+def decisions(link: Optional[str], as_json: bool):
+    """Get the recent decisions of the run service's probe scheduler."""
+    try:
+        response = ControlHandler.request("decisions", link=link)
+    except ValueError as e:
+        error(e)
+        return
+    if response is None:
+        error("The run service is not running.")
+        return
+
+    result = response["result"]
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+        return
+    if not result:
+        click.echo("No probe has been scheduled yet.")
+        return
+    click.echo(f"{'at':<19} {'outcome':<16} {'failures':>8} {'delay':>8}  reason")
+    for decision in result:
+        at = datetime.fromtimestamp(decision["at"])
+        click.echo(
+            f"{at:%Y-%m-%d %H:%M:%S} {decision['outcome']:<16}"
+            f" {decision['failures']:>8} {decision['delay']:>7.1f}s  {decision['reason']}"
+        )
+
+
+@get.command()
+@click.option("--json", "as_json", is_flag=True, help="Output as JSON.")
+def links(as_json: bool):
+    """Get the session of each interface managed by the run service."""
+    try:
+        response = ControlHandler.request("links")
+    except ValueError as e:
+        error(e)
+        return
+    if response is None:
+        error("The run service is not running.")
+        return
+
+    result = response["result"]
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+        return
+    click.echo(f"{'link':<10} {'session':<16} {'last probe':<10} {'keepalive in':>12}")
+    for status in result:
+        probe = status["last_probe"]
+        keepalive_in = status["keepalive_in"]
+        click.echo(
+            f"{status['link'] or 'default':<10} {status['ip'] or '-':<16}"
+            f" {probe['state'] if probe else '-':<10}"
+            f" {'-' if keepalive_in == float('inf') else f'{keepalive_in:.0f}s':>12}"
+        )
+
+
+@get.command()
+@click.option("--json", "as_json", is_flag=True, help="Output as JSON.")
+def breakers(as_json: bool):
+    """Get the circuit breakers of the portals and the quarantined accounts."""
+    try:
+        response = ControlHandler.request("breakers")
+    except ValueError as e:
+        error(e)
+        return
+    if response is None:
+        error("The run service is not running.")
+        return
+
+    result = response["result"]
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+        return
+    if not result:
+        click.echo("No login has failed yet.")
+        return
+    click.echo(
+        f"{'kind':<8} {'link':<10} {'portal or account':<24} {'state':<10}"
+        f" {'failures':>8} {'retry in':>9}"
+    )
+    for breaker in result:
+        click.echo(
+            f"{breaker['kind']:<8} {breaker['link'] or '-':<10} {breaker['key']:<24}"
+            f" {breaker['state']:<10} {breaker['failures']:>8}"
+            f" {breaker['retry_in']:>8.0f}s"
+        )
+
+
+@get.command(name="config")
+@click.option("--json", "as_json", is_flag=True, help="Output as JSON.")
+def config_(as_json: bool):
+    """Get the settings in effect and where each one came from."""
+    from handlers.config_handler import ConfigHandler
+
+    try:
+        response = ControlHandler.request("config")
+    except ValueError as e:
+        error(e)
+        return
+    # Without the run service, as this command loaded them
+    result = response["result"] if response is not None else ConfigHandler.status()
+
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+        return
+    click.echo(f"{'setting':<30} {'source':<8} {'live':<5} value")
+    for setting in result:
+        click.echo(
+            f"{setting['name']:<30} {setting['source']:<8}"
+            f" {'yes' if setting['live'] else 'no':<5} {json.dumps(setting['value'])}"
+        )
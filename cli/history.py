@@ -0,0 +1,102 @@
+import json
+import re
+import click
+from datetime import datetime
+from time import time
+from logging import error
+from typing import Any, Dict, List, Optional, Tuple
+
+from handlers.control_handler import ControlHandler
+from handlers.journal_handler import Event, JournalHandler
+
+DURATION_PATTERN = re.compile(r"(?:\d+(?:\.\d+)?[smhdw])+")
+DURATION_PART_PATTERN = re.compile(r"(\d+(?:\.\d+)?)([smhdw])")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a duration ago like 30m, 2h or 1d12h, or an ISO date and time.
+    Raises:
+        click.BadParameter: If the value is neither.
+    """
+    if value is None:
+        return None
+    if DURATION_PATTERN.fullmatch(value):
+        seconds = sum(
+            float(amount) * DURATION_UNITS[unit]
+            for amount, unit in DURATION_PART_PATTERN.findall(value)
+        )
+        return time() - seconds
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise click.BadParameter(f"{value!r} is not a duration like 2h or an ISO date.")
+
+
+def describe(event: Dict[str, Any]) -> str:
+    details = []
+    for key, value in event.items():
+        if key in ("t", "e", "link"):
+            continue
+        if key == "seconds":
+            details.append(f"{value:.3f}s")
+        elif isinstance(value, dict):
+            details.append(" ".join(f"{k}={v:.3f}s" for k, v in value.items()))
+        else:
+            details.append(f"{key}={value}")
+    return " ".join(details)
+
+
+@click.command()
+@click.option("--since", help="Start of the range: a duration ago like 2h, or an ISO date.")
+@click.option("--until", help="End of the range: a duration ago like 30m, or an ISO date.")
+@click.option(
+    "--kind",
+    "kinds",
+    multiple=True,
+    type=click.Choice(Event.ALL),
+    help="Only show events of this kind. Can be repeated.",
+)
+@click.option("--interface", "link", help="Only show events of this interface.")
+@click.option("--limit", type=int, default=50, help="Most recent events shown, 0 for all.")
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["table", "json"]),
+    default="table",
+    help="Output format.",
+)
+def history(
+    since: Optional[str],
+    until: Optional[str],
+    kinds: Tuple[str, ...],
+    link: Optional[str],
+    limit: int,
+    output_format: str,
+):
+    """Show the history of probes, logins, keepalives and network changes."""
+    query = {
+        "since": parse_time(since),
+        "until": parse_time(until),
+        "kinds": list(kinds),
+        "link": link,
+    }
+    try:
+        response = ControlHandler.request("history", **query)
+    except ValueError as e:
+        error(e)
+        return
+    events: List[Dict[str, Any]] = (
+        response["result"] if response is not None else JournalHandler.query(**query)
+    )
+    if limit > 0:
+        events = events[-limit:]
+
+    if output_format == "json":
+        click.echo(json.dumps(events, indent=2))
+        return
+    for event in events:
+        moment = datetime.fromtimestamp(event["t"]).strftime("%Y-%m-%d %H:%M:%S")
+        where = f"{event['link']:<8}  " if "link" in event else ""
+        click.echo(f"{moment}  {where}{event['e']:<9}  {describe(event)}")
@@ -0,0 +1,53 @@
+import click
+from click.utils import make_default_short_help
+from importlib import import_module
+from typing import Dict, List, Optional, Tuple
+
+
+class LazyGroup(click.Group):
+    """
+    Click group whose subcommands are imported only when they are invoked,
+    so that short commands don't pay for the imports of the others. Their
+    short help is given with the path, so that --help imports none of them.
+    """
+
+    def __init__(
+        self,
+        *args,
+        lazy_subcommands: Optional[Dict[str, Tuple[str, str]]] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        # Maps a command name to the "module.attribute" path of the command
+        # and its short help
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx: click.Context) -> List[str]:
+        return sorted([*super().list_commands(ctx), *self.lazy_subcommands])
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> Optional[click.Command]:
+        if cmd_name not in self.lazy_subcommands:
+            return super().get_command(ctx, cmd_name)
+        module_name, attribute = self.lazy_subcommands[cmd_name][0].rsplit(".", 1)
+        command = getattr(import_module(module_name), attribute)
+        assert isinstance(command, click.Command)
+        return command
+
+    def format_commands(
+        self, ctx: click.Context, formatter: click.HelpFormatter
+    ) -> None:
+        names = self.list_commands(ctx)
+        # Shortened to fit one line, as click.Group does
+        limit = formatter.width - 6 - max(map(len, names), default=0)
+        rows = []
+        for name in names:
+            if name in self.lazy_subcommands:
+                short_help = self.lazy_subcommands[name][1]
+                rows.append((name, make_default_short_help(short_help, limit)))
+                continue
+            command = self.get_command(ctx, name)
+            if command is not None and not command.hidden:
+                rows.append((name, command.get_short_help_str(limit)))
+        if rows:
+            with formatter.section("Commands"):
+                formatter.write_dl(rows)
@@ -0,0 +1,334 @@
+import click
+import signal
+import sys
+import threading
+from os import getpid
+from dataclasses import asdict
+from pathlib import Path
+from time import perf_counter
+from logging import error, info
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from requests.exceptions import RequestException
+
+import config
+from handlers.breaker_handler import CircuitBreakerHandler
+from handlers.clock_handler import ClockWatcher
+from handlers.config_handler import ConfigHandler
+from handlers.control_handler import ControlHandler
+from handlers.http_handler import DnsCache, HttpHandler
+from handlers.journal_handler import Event, JournalHandler
+from handlers.keepalive_handler import KeepaliveHandler
+from handlers.link_handler import LinkHandler
+from handlers.metrics_handler import MetricsHandler
+from handlers.network_handler import NetworkWatcher
+from handlers.portal_handler import PortalHandler
+from handlers.prediction_handler import SessionPredictor
+from handlers.scheduler_handler import SCHEDULERS, Outcome, Scheduler
+from handlers.session_handler import LoginResult, SessionHandler
+from handlers.service_handler import ServiceHandler
+from handlers.systemd_handler import SystemdNotifier
+from utils import Warp
+
+LOGIN_OUTCOMES = {
+    LoginResult.LOGGED_IN: Outcome.LOGGED_IN,
+    LoginResult.NOT_NEEDED: Outcome.ONLINE,
+    LoginResult.NO_CREDENTIALS: Outcome.AUTH_FAILED,
+    LoginResult.AUTH_FAILED: Outcome.AUTH_FAILED,
+    LoginResult.QUARANTINED: Outcome.AUTH_FAILED,
+    LoginResult.UNREACHABLE: Outcome.UNREACHABLE,
+    LoginResult.CIRCUIT_OPEN: Outcome.UNREACHABLE,
+}
+
+
+def probe_and_login() -> str:
+    """
+    Probes for the captive portal and logs in if it is found.
+    Returns:
+        str: The Outcome of the iteration.
+    """
+    start = perf_counter()
+    try:
+        with MetricsHandler.span("probe"):
+            result = PortalHandler.trigger_captive_portal()
+    except RequestException as e:
+        JournalHandler.record(
+            Event.PROBE, state="offline", seconds=perf_counter() - start
+        )
+        error(f"Run: {e}")
+        return Outcome.UNREACHABLE
+    except Exception as e:
+        error(f"Run: {e}")
+        return Outcome.ERROR
+
+    state = "online" if result is None else "captive"
+    JournalHandler.record(Event.PROBE, state=state, seconds=perf_counter() - start)
+    if result is None:
+        return Outcome.ONLINE
+    try:
+        info(f"Run: Captive portal detected.")
+        with MetricsHandler.span("login"):
+            login_result = SessionHandler.login(username=None, password=None)
+        if login_result == LoginResult.LOGGED_IN:
+            KeepaliveHandler.schedule()
+        return LOGIN_OUTCOMES[login_result]
+    except RequestException as e:
+        error(f"Run: {e}")
+        return Outcome.UNREACHABLE
+    except Exception as e:
+        error(f"Run: {e}")
+        return Outcome.ERROR
+
+
+def link_status(link: Optional[str]) -> Dict[str, Any]:
+    """Returns the session, keepalive and last probe of an interface."""
+    with LinkHandler.use(link):
+        details = SessionHandler.read_session_details()
+        with JournalHandler.LOCK:
+            events = list(JournalHandler.EVENTS)
+        probes = [
+            event
+            for event in events
+            if event["e"] == Event.PROBE and event.get("link") == link
+        ]
+        return {
+            "link": link,
+            "ip": details[0] if details is not None else None,
+            "logged_in": details is not None,
+            "last_probe": probes[-1] if probes else None,
+            "keepalive_in": KeepaliveHandler.time_until_due(),
+            "prediction": SessionPredictor.as_dict(),
+        }
+
+
+def serve_control(schedulers: Dict[Optional[str], Scheduler]) -> None:
+    """
+    Lets CLI commands run in this warm process through the control socket.
+    Args:
+        schedulers: The probe scheduler of each managed interface.
+    """
+    links = list(schedulers)
+
+    def on(operation: Callable[..., Any]) -> Callable[..., Any]:
+        """Runs a command on the interface given as its link argument."""
+
+        def command(*args: Any, link: Optional[str] = None, **kwargs: Any) -> Any:
+            with LinkHandler.use(link):
+                return operation(*args, **kwargs)
+
+        return command
+
+    def login(username: Optional[str] = None, password: Optional[str] = None) -> str:
+        result = SessionHandler.login(username=username, password=password)
+        if result == LoginResult.LOGGED_IN:
+            KeepaliveHandler.schedule()
+        return result
+
+    def logout() -> None:
+        SessionHandler.logout()
+        KeepaliveHandler.cancel()
+
+    def decisions() -> List[Dict[str, Any]]:
+        link = LinkHandler.current()
+        if link not in schedulers:
+            raise ValueError(f"Interface {link} is not managed by the run service.")
+        return [asdict(decision) for decision in schedulers[link].decisions]
+
+    ControlHandler.register("ping", lambda: {"pid": getpid()})
+    ControlHandler.register("login", on(login))
+    ControlHandler.register("logout", on(logout))
+    ControlHandler.register("session", on(SessionHandler.get_session_details))
+    ControlHandler.register("history", JournalHandler.query)
+    ControlHandler.register("prediction", on(SessionPredictor.as_dict))
+    ControlHandler.register("decisions", on(decisions))
+    ControlHandler.register("links", lambda: [link_status(link) for link in links])
+    ControlHandler.register("breakers", CircuitBreakerHandler.status)
+    ControlHandler.register("config", ConfigHandler.status)
+    try:
+        ControlHandler.serve()
+    except OSError as e:
+        error(f"Run: Control socket unavailable: {e}")
+
+
+def follow_prediction(probe_at: float) -> float:
+    """
+    Moves the next probe, and the keepalive, up to just before the predicted
+    end of the session, so that its end is noticed within seconds.
+    Returns:
+        float: The boot time of the next probe.
+    """
+    until_watch = SessionPredictor.time_until_watch()
+    if until_watch > config.SESSION_WATCH_INTERVAL:
+        # One last keepalive before the watch, in case it extends the session
+        KeepaliveHandler.advance(until_watch)
+    return min(probe_at, ClockWatcher.now() + until_watch)
+
+
+def run_loop(
+    probe_scheduler: Scheduler, metrics_textfile: Optional[Path], prewarm: bool
+) -> None:
+    """
+    Probes, logs in and keeps the session alive on the current interface.
+
+    Times are boot times (see ClockWatcher), which keep counting while the
+    machine is suspended, as the portal's session timers do.
+    """
+    link = LinkHandler.current()
+    on = f"{link}: " if link is not None else ""
+    watcher = NetworkWatcher(interface=link)
+    ClockWatcher.on_wake(watcher.wake)
+    wakes = ClockWatcher.WAKES
+    KeepaliveHandler.schedule(0)
+    probe_at = ClockWatcher.now()
+    offline_since: Optional[float] = None
+    while True:
+        if ClockWatcher.now() >= probe_at:
+            outcome = probe_and_login()
+            if outcome not in (Outcome.ONLINE, Outcome.LOGGED_IN):
+                offline_since = offline_since or ClockWatcher.now()
+            elif offline_since is not None:
+                MetricsHandler.observe(
+                    "time_to_online", ClockWatcher.now() - offline_since
+                )
+                offline_since = None
+            MetricsHandler.save(metrics_textfile)
+            SystemdNotifier.status(f"{on}Last probe: {outcome}")
+            decision = probe_scheduler.decide(outcome)
+            probe_at = follow_prediction(ClockWatcher.now() + decision.delay)
+            # The keepalive below may log in too, each login within the watchdog
+            SystemdNotifier.watchdog(link)
+
+        try:
+            KeepaliveHandler.run_if_due()
+        except Exception as e:
+            error(f"Run: {e}")
+        probe_at = follow_prediction(probe_at)
+
+        # Reaching this point means the loop is not stuck
+        SystemdNotifier.watchdog(link)
+        timeout = min(
+            probe_at - ClockWatcher.now(),
+            KeepaliveHandler.time_until_due(),
+            SystemdNotifier.time_until_watchdog(link),
+        )
+        changed = watcher.wait(max(timeout, 0))
+        woke = ClockWatcher.WAKES != wakes
+        if woke:
+            # The session most likely expired while asleep, probe right away
+            wakes = ClockWatcher.WAKES
+            info(f"Run: {on}Woke up after a suspend or clock change.")
+            JournalHandler.record(Event.CLOCK, **ClockWatcher.LAST)
+            offline_since = ClockWatcher.now()
+        elif changed:
+            info(f"Run: {on}Network change detected.")
+            JournalHandler.record(Event.NETWORK)
+            offline_since = offline_since or ClockWatcher.now()
+        if woke or changed:
+            HttpHandler.reset()
+            DnsCache.clear()
+            Warp.invalidate()
+            details = SessionHandler.read_session_details()
+            if prewarm and details is not None:
+                # The portal, if any, is most likely the last one logged in to
+                HttpHandler.prewarm(f"http://{details[0]}/")
+            decision = probe_scheduler.decide(Outcome.NETWORK_CHANGED)
+            probe_at = ClockWatcher.now() + decision.delay
+
+
+@click.command()
+@click.option(
+    "--scheduler",
+    type=click.Choice(list(SCHEDULERS)),
+    default=lambda: config.SCHEDULER,
+    help="How the interval between probes is chosen.",
+)
+@click.option(
+    "--metrics-textfile",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Also export metrics to this Prometheus textfile.",
+)
+@click.option(
+    "--prewarm/--no-prewarm",
+    default=lambda: config.PREWARM_GATEWAY,
+    help="Pre-open a connection to the last portal gateway on network changes.",
+)
+@click.option(
+    "--interface",
+    "interfaces",
+    multiple=True,
+    default=lambda: config.INTERFACES,
+    help="Manage a separate session on this interface. Can be repeated.",
+)
+def run(
+    scheduler: str,
+    metrics_textfile: Optional[Path],
+    prewarm: bool,
+    interfaces: Tuple[str, ...],
+):
+    """Run the IIITK Portal Loginator service in the foreground."""
+
+    if (
+        not config.ANDROID
+        and ServiceHandler.status()
+        and ServiceHandler.invocation_id() is None
+    ):
+        error("Service is already running.")
+        return
+    if ControlHandler.request("ping") is not None:
+        error("Service is already running.")
+        return
+
+    links: List[Optional[str]] = list(dict.fromkeys(interfaces)) or [None]
+    for link in links:
+        if link is None:
+            continue
+        try:
+            LinkHandler.index(link)
+        except OSError:
+            error(f"No such interface: {link}")
+            return
+        try:
+            LinkHandler.check_bind(link)
+        except PermissionError:
+            error(
+                f"Cannot bind to {link}: before Linux 5.7 this needs the"
+                " CAP_NET_RAW capability, e.g. granted with setcap to the Python"
+                " interpreter."
+            )
+            return
+        except OSError as e:
+            error(f"Cannot bind to {link}: {e}")
+            return
+
+    # Exit through the finally below when stopped by systemd or pkill
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGHUP, lambda *_: ConfigHandler.RELOAD.set())
+    JournalHandler.load()
+    schedulers = {link: SCHEDULERS[scheduler]() for link in links}
+    serve_control(schedulers)
+    ClockWatcher.watch()
+    ConfigHandler.watch()
+    SystemdNotifier.watch(links)
+    SystemdNotifier.ready()
+
+    def run_link(link: Optional[str]) -> None:
+        with LinkHandler.use(link):
+            run_loop(schedulers[link], metrics_textfile, prewarm)
+
+    try:
+        if len(links) == 1:
+            run_link(links[0])
+            return
+        threads = [
+            threading.Thread(target=run_link, args=(link,), name=link, daemon=True)
+            for link in links
+        ]
+        for thread in threads:
+            thread.start()
+        # Joined with a timeout, so that signals still reach the main thread
+        while all(thread.is_alive() for thread in threads):
+            threads[0].join(1)
+        error("Run: A link loop has stopped, exiting.")
+        sys.exit(1)
+    finally:
+        SystemdNotifier.stopping()
+        ControlHandler.close()
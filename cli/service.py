@@ -62,8 +62,4 @@ def status():
 @service.command()
 def setup():
     """Setup the IIITK Portal Loginator service."""
-    ServiceHandler.stop()
-    ServiceHandler.disable()
-    ServiceHandler.create()
-    ServiceHandler.enable()
-    ServiceHandler.start()
+    ServiceHandler.setup()
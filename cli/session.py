@@ -0,0 +1,118 @@
+import click
+from logging import error
+from typing import List, Optional
+
+import config
+from handlers.control_handler import ControlHandler
+from handlers.link_handler import LinkHandler
+
+
+@click.command()
+@click.option(
+    "--username",
+    "-u",
+    type=str,
+    help="If not provided, will use stored credentials.",
+)
+@click.option(
+    "--password",
+    "-p",
+    type=str,
+    help="If not provided, will use stored credentials.",
+)
+@click.option(
+    "--all", "all_users", is_flag=True, help="Log in every stored account concurrently."
+)
+@click.option(
+    "--users",
+    type=str,
+    help="Comma separated stored accounts to log in concurrently.",
+)
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=lambda: config.BATCH_CONCURRENCY,
+    help="Logins in flight at once, with --all or --users.",
+)
+@click.option(
+    "--rate",
+    type=click.FloatRange(min=0),
+    default=lambda: config.BATCH_RATE_LIMIT,
+    help="Logins per second sent to each portal, 0 for no limit.",
+)
+@click.option("--interface", "link", help="Log in on this interface.")
+def login(
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    all_users: bool = False,
+    users: Optional[str] = None,
+    concurrency: Optional[int] = None,
+    rate: Optional[float] = None,
+    link: Optional[str] = None,
+):
+    """Login to the IIITK Portal."""
+    if username is None and password is not None:
+        raise click.UsageError("Username must be provided if password is given.")
+    if all_users or users is not None:
+        if username is not None or (all_users and users is not None):
+            raise click.UsageError("Use only one of --username, --all and --users.")
+        usernames = (
+            None if all_users else [u.strip() for u in users.split(",") if u.strip()]
+        )
+        # Its logins would race the batch's for the portal and the token file
+        if ControlHandler.request("ping") is not None:
+            error("Stop the run service before logging in several accounts.")
+            return
+        with LinkHandler.use(link):
+            login_batch(usernames, concurrency, rate)
+        return
+    try:
+        response = ControlHandler.request(
+            "login", username=username, password=password, link=link
+        )
+    except ValueError as e:
+        error(e)
+        return
+    if response is not None:
+        result = response["result"]
+    else:
+        from handlers.session_handler import SessionHandler
+
+        with LinkHandler.use(link):
+            result = SessionHandler.login(username=username, password=password)
+    click.echo(f"Login: {result}")
+
+
+def login_batch(usernames: Optional[List[str]], concurrency: int, rate: float) -> None:
+    from handlers.batch_handler import BatchLoginHandler
+
+    results = BatchLoginHandler.login(usernames, concurrency, rate)
+    if not results:
+        error("No stored accounts to log in.")
+        return
+    width = max(len(account.username) for account in results)
+    for account in results:
+        line = (
+            f"{account.username:<{width}}  {account.result:<14} {account.seconds:.2f}s"
+        )
+        click.echo(f"{line}  {account.error}" if account.error else line)
+
+
+@click.command()
+@click.option("--interface", "link", help="Log out on this interface.")
+def logout(link: Optional[str] = None):
+    """Logout from the IIITK Portal."""
+    try:
+        response = ControlHandler.request("logout", link=link)
+    except ValueError as e:
+        error(e)
+        return
+    if response is None:
+        from handlers.session_handler import SessionHandler
+
+        try:
+            with LinkHandler.use(link):
+                SessionHandler.logout()
+        except ValueError:
+            return
+    click.echo("Logged out successfully.")
@@ -4,11 +4,79 @@ from pathlib import Path
 SECRET_LABEL = "iiitk_portal_login"
 TOKEN_FILE = Path.home() / ".iiitk_portal_session"
 SECRET_FILE = Path.home() / ".iiitk_portal_credentials"
+SECRET_LOCK_FILE = Path.home() / ".iiitk_portal_credentials.lock"
+FORM_CACHE_FILE = Path.home() / ".iiitk_portal_forms"
+METRICS_FILE = Path.home() / ".iiitk_portal_metrics"
+CONTROL_SOCKET = Path.home() / ".iiitk_portal.sock"
+LOGIN_LOCK_FILE = Path.home() / ".iiitk_portal_login.lock"
+LOGIN_STATE_FILE = Path.home() / ".iiitk_portal_login.state"
+CREDENTIALS_STAMP_FILE = Path.home() / ".iiitk_portal_credentials_stamp"
+JOURNAL_FILE = Path.home() / ".iiitk_portal_journal"
+CONFIG_FILE = Path.home() / ".iiitk_portal_config"  # JSON overriding the tunables below
+CONFIG_ENV_PREFIX = "IIITK_PORTAL_"  # e.g. IIITK_PORTAL_HTTP_TIMEOUT=10
+CONFIG_POLL_INTERVAL = 5  # seconds between checks of CONFIG_FILE by the run service
+CREDENTIALS_CACHE_TTL = 15 * 60  # seconds
 CHECK_INTERVAL = 60  # seconds
+IDLE_CHECK_INTERVAL = 600  # seconds, while online and the network is unchanged
+EVENT_SETTLE_DELAY = 2  # seconds to coalesce bursts of network events
+ROUTE_FILE = Path("/proc/net/route")
+ROUTE_POLL_INTERVAL = 2  # seconds, when netlink events are unavailable
+CLOCK_CHECK_INTERVAL = 5  # seconds between checks for a resume or clock change
+CLOCK_JUMP_THRESHOLD = 2  # seconds the clocks may drift apart before a jump is assumed
+SCHEDULER = "adaptive"  # or "fixed"
+SCHEDULER_FAST_RETRY_INTERVAL = 5  # seconds, after the first transient failures
+SCHEDULER_FAST_RETRIES = 2
+SCHEDULER_BACKOFF_BASE = 15  # seconds, doubled after each further failure
+SCHEDULER_BACKOFF_MAX = 600  # seconds
+SCHEDULER_HISTORY_SIZE = 32  # decisions kept for inspection
+METRICS_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]  # seconds
+METRICS_SAMPLES = 512  # recent samples kept per phase for percentiles
+JOURNAL_BUFFER_SIZE = 1024  # events kept in memory
+JOURNAL_MAX_BYTES = 1024 * 1024  # journal file size before it is rotated
+JOURNAL_ROTATIONS = 3  # rotated journal files kept
+SESSION_HISTORY_SIZE = 20  # recent sessions the lifetime prediction learns from
+SESSION_MIN_SAMPLES = 3  # sessions needed for a fully confident prediction
+SESSION_MIN_CONFIDENCE = 0.5  # below this the prediction is shown but not acted on
+SESSION_PREDICTION_LEAD = 30  # seconds before and after the predicted expiry to watch
+SESSION_WATCH_INTERVAL = 3  # seconds between probes while watching
+CONTROL_TIMEOUT = 60  # seconds to wait for the run service to answer, more for a login
+BATCH_CONCURRENCY = 8  # logins in flight at once for login --all / --users
+BATCH_RATE_LIMIT = 5  # logins per second sent to one portal, 0 for no limit
+SINGLE_FLIGHT_TIMEOUT = 120  # seconds to wait for a login in progress
+WARP_STATE_TTL = 30  # seconds the Warp connection state is trusted without warp-cli
+KEEPALIVE_INTERVAL = 240  # seconds, must be shorter than the portal's session timeout
+KEEPALIVE_RETRY_INTERVAL = 10  # seconds, doubled after each failed keepalive
+KEEPALIVE_MAX_FAILURES = 5
+PORTAL_FAILURE_THRESHOLD = 3  # consecutive 5xx answers or timeouts that open the portal's circuit
+PORTAL_BREAKER_COOLDOWN = 30  # seconds open before a trial login, doubled after each failed one
+PORTAL_BREAKER_MAX_COOLDOWN = 600  # seconds
+ACCOUNT_QUARANTINE = 3600  # seconds an account whose credentials were rejected is skipped
+ACCOUNT_QUARANTINE_MAX = 86400  # seconds, the quarantine doubles after each rejected trial
+
+HTTP_TIMEOUT = 5  # seconds
+PROBE_TIMEOUT = 5  # seconds for all probe endpoints together
+# Raced concurrently, along with the keepalive url of the stored session
+PROBE_URLS = [
+    "http://clients3.google.com/generate_204",
+    "http://connectivitycheck.gstatic.com/generate_204",
+    "http://cp.cloudflare.com/generate_204",
+]
+HTTP_POOL_CONNECTIONS = 4  # number of hosts to keep pools for
+HTTP_POOL_MAXSIZE = 4  # connections kept alive per host
+STREAM_CHUNK_SIZE = 4096  # bytes
+STREAM_MAX_BYTES = 256 * 1024  # bytes read from a portal page before giving up
+DNS_CACHE_TTL = 300  # seconds a resolved host name is reused
+DNS_NEGATIVE_TTL = 5  # seconds a failed lookup is remembered
+DNS_CACHE_SIZE = 64  # host names kept
+PREWARM_GATEWAY = True  # pre-open a connection to the portal gateway after a link change
+PREWARM_TIMEOUT = 2  # seconds
+INTERFACES = []  # uplinks run manages a session on each, empty for the default route
 
 SERVICE_NAME = SECRET_LABEL
 SCRIPT_PATH = Path(__file__).resolve()
 USER_SYSTEMD_PATH = Path.home() / ".config" / "systemd" / "user"
 SERVICE_FILE = USER_SYSTEMD_PATH / f"{SERVICE_NAME}.service"
+SERVICE_WATCHDOG_SEC = 180  # must outlast the slowest loop iteration, see SINGLE_FLIGHT_TIMEOUT
 
-ANDROID = False
\ No newline at end of file
+ANDROID = False
+FORM_PARSER = "stream"  # or "bs4"
\ No newline at end of file
@@ -0,0 +1,130 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from time import monotonic, perf_counter, sleep
+from logging import error, info
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import config
+from utils import Warp
+from handlers.journal_handler import Event, JournalHandler
+from handlers.link_handler import LinkHandler
+from handlers.secret_handler import get_secret_handler
+from handlers.session_handler import LoginResult, SessionHandler
+
+
+@dataclass
+class AccountResult:
+    username: str
+    result: str  # LoginResult
+    seconds: float
+    error: Optional[str] = None
+
+
+class PortalRateLimiter:
+    """Spaces out the logins sent to each portal host."""
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_at: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url: str) -> None:
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = monotonic()
+            at = max(now, self.next_at.get(host, now))
+            self.next_at[host] = at + self.interval
+        if at > now:
+            sleep(at - now)
+
+
+class BatchLoginHandler:
+    """
+    Logs many stored accounts in concurrently, with at most `concurrency`
+    logins in flight and at most `rate` logins per second sent to any one
+    portal. Warp is disconnected once for the whole batch.
+
+    The portal authenticates by source address, so accounts that share one
+    only share one session: after the first login the others find no portal
+    and report not_needed.
+    """
+
+    @staticmethod
+    def login_account(
+        username: str, limiter: PortalRateLimiter, link: Optional[str] = None
+    ) -> AccountResult:
+        with LinkHandler.use(link):
+            return BatchLoginHandler.login_on_link(username, limiter)
+
+    @staticmethod
+    def login_on_link(username: str, limiter: PortalRateLimiter) -> AccountResult:
+        start = perf_counter()
+        try:
+            username, password = get_secret_handler().get_user_credentials(username)
+        except ValueError as e:
+            return AccountResult(
+                username, LoginResult.NO_CREDENTIALS, perf_counter() - start, str(e)
+            )
+
+        try:
+            result = SessionHandler.perform_login(
+                username=username, password=password, warp=False, ready=limiter.wait
+            )
+            account = AccountResult(username, result, perf_counter() - start)
+        except Exception as e:
+            error(f"Batch: login of {username} failed: {e}")
+            account = AccountResult(
+                username, LoginResult.UNREACHABLE, perf_counter() - start, str(e)
+            )
+        JournalHandler.record(
+            Event.LOGIN, result=account.result, seconds=account.seconds, user=username
+        )
+        return account
+
+    @staticmethod
+    def login(
+        usernames: Optional[List[str]] = None,
+        concurrency: Optional[int] = None,
+        rate: Optional[float] = None,
+    ) -> List[AccountResult]:
+        """
+        Logs in the given accounts, or every stored account, by default
+        BATCH_CONCURRENCY at a time and at most BATCH_RATE_LIMIT per second.
+        Returns:
+            The result of each account, in the given order.
+        """
+        if concurrency is None:
+            concurrency = config.BATCH_CONCURRENCY
+        if rate is None:
+            rate = config.BATCH_RATE_LIMIT
+        if usernames is None:
+            usernames = get_secret_handler().get_all_users()
+        if not usernames:
+            return []
+
+        info(f"Batch: logging in {len(usernames)} accounts, {concurrency} at a time.")
+        limiter = PortalRateLimiter(rate)
+        link = LinkHandler.current()  # the pool threads do not inherit it
+        Warp.disconnect()
+        try:
+            with ThreadPoolExecutor(
+                max_workers=max(concurrency, 1), thread_name_prefix="login"
+            ) as pool:
+                results = list(
+                    pool.map(
+                        lambda username: BatchLoginHandler.login_account(
+                            username, limiter, link
+                        ),
+                        usernames,
+                    )
+                )
+        finally:
+            Warp.restore()
+
+        counts: Dict[str, int] = {}
+        for account in results:
+            counts[account.result] = counts.get(account.result, 0) + 1
+        info(f"Batch: {counts}")
+        return results
@@ -0,0 +1,249 @@
+import threading
+from dataclasses import dataclass
+from hashlib import sha256
+from logging import info, warning
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from requests.exceptions import ConnectionError, RequestException, Timeout
+
+import config
+from handlers.clock_handler import ClockWatcher
+from handlers.link_handler import LinkHandler
+
+
+class PortalServerError(RequestException):
+    """The portal answered with a 5xx status."""
+
+
+class CircuitOpenError(Exception):
+    """The portal's circuit is open, so nothing was sent to it."""
+
+
+class Failure:
+    """Kinds of login failures, each with its own circuit breakers."""
+
+    AUTH = "auth"  # credentials rejected, per account
+    SERVER = "server"  # 5xx or unusable answers, per portal
+    TIMEOUT = "timeout"  # timeouts and refused connections, per portal
+
+
+class BreakerState:
+    CLOSED = "closed"  # requests are let through
+    OPEN = "open"  # requests are refused until retry_at
+    HALF_OPEN = "half_open"  # one trial request is in flight
+
+
+@dataclass
+class CircuitBreaker:
+    threshold: int  # consecutive failures that open the circuit
+    cooldown: float  # seconds open before a trial, doubled after each failed one
+    max_cooldown: float
+    state: str = BreakerState.CLOSED
+    failures: int = 0  # consecutive failures
+    trips: int = 0  # times opened since last closed
+    retry_at: float = 0.0  # boot time a trial is allowed from
+
+    def ready(self) -> bool:
+        """Returns whether a request may be sent, without claiming a trial."""
+        if self.state == BreakerState.OPEN:
+            return ClockWatcher.now() >= self.retry_at
+        return self.state == BreakerState.CLOSED
+
+    def allow(self) -> bool:
+        """Returns whether a request may be sent, claiming the trial if one is due."""
+        if not self.ready():
+            return False
+        if self.state == BreakerState.OPEN:
+            self.state = BreakerState.HALF_OPEN
+        return True
+
+    def succeed(self) -> bool:
+        """
+        Returns:
+            bool: Whether the circuit closed.
+        """
+        closed = self.state != BreakerState.CLOSED
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.trips = 0
+        return closed
+
+    def fail(self) -> Optional[float]:
+        """
+        Returns:
+            The cooldown if the circuit opened, otherwise None.
+        """
+        self.failures += 1
+        if self.state != BreakerState.HALF_OPEN and self.failures < self.threshold:
+            return None
+        cooldown = min(self.cooldown * 2**self.trips, self.max_cooldown)
+        self.state = BreakerState.OPEN
+        self.trips += 1
+        self.retry_at = ClockWatcher.now() + cooldown
+        return cooldown
+
+    def release(self) -> None:
+        """Gives back a trial that ended without a verdict, for the next request."""
+        if self.state == BreakerState.HALF_OPEN:
+            self.state = BreakerState.OPEN
+
+    def time_until_trial(self) -> float:
+        if self.state == BreakerState.CLOSED:
+            return 0
+        return max(self.retry_at - ClockWatcher.now(), 0)
+
+
+class CircuitBreakerHandler:
+    """
+    Stops the run loop from hammering a failing portal or re-posting
+    credentials it has rejected, which only wastes requests and risks an
+    account lockout.
+
+    Each portal, per interface, has one breaker for 5xx answers and one for
+    timeouts, opened by PORTAL_FAILURE_THRESHOLD consecutive failures of
+    their kind. Each account has one that opens on the first rejection: it
+    is quarantined for ACCOUNT_QUARANTINE, and logins with stored
+    credentials fail over to the next account. Open breakers let one trial
+    request through after their cooldown, which doubles every time the
+    trial fails. Storing new credentials for an account lifts its quarantine.
+    """
+
+    BREAKERS: Dict[Tuple[str, Optional[str], str], CircuitBreaker] = {}
+    FINGERPRINTS: Dict[str, str] = {}  # account: credentials it was quarantined with
+    LOCK = threading.Lock()
+
+    @staticmethod
+    def breaker(kind: str, key: str, link: Optional[str] = None) -> CircuitBreaker:
+        breaker = CircuitBreakerHandler.BREAKERS.get((kind, link, key))
+        if breaker is None:
+            breaker = CircuitBreakerHandler.BREAKERS[(kind, link, key)] = (
+                CircuitBreaker(0, 0, 0)
+            )
+        # Read each time, so that a reloaded configuration applies to open ones
+        if kind == Failure.AUTH:
+            breaker.threshold = 1
+            breaker.cooldown = config.ACCOUNT_QUARANTINE
+            breaker.max_cooldown = config.ACCOUNT_QUARANTINE_MAX
+        else:
+            breaker.threshold = config.PORTAL_FAILURE_THRESHOLD
+            breaker.cooldown = config.PORTAL_BREAKER_COOLDOWN
+            breaker.max_cooldown = config.PORTAL_BREAKER_MAX_COOLDOWN
+        return breaker
+
+    @staticmethod
+    def portal_breakers(url: str) -> List[CircuitBreaker]:
+        host = urlsplit(url).netloc
+        link = LinkHandler.current()
+        return [
+            CircuitBreakerHandler.breaker(kind, host, link)
+            for kind in (Failure.SERVER, Failure.TIMEOUT)
+        ]
+
+    @staticmethod
+    def fingerprint(username: str, password: str) -> str:
+        return sha256(f"{username}\0{password}".encode()).hexdigest()
+
+    @staticmethod
+    def classify(e: BaseException) -> str:
+        if isinstance(e, (Timeout, ConnectionError)):
+            return Failure.TIMEOUT
+        return Failure.SERVER
+
+    @staticmethod
+    def check_portal(url: str) -> None:
+        """
+        Raises:
+            CircuitOpenError: If a breaker of the portal is open.
+        """
+        with CircuitBreakerHandler.LOCK:
+            breakers = CircuitBreakerHandler.portal_breakers(url)
+            # Claims the trials only once every breaker lets the request through
+            if all(breaker.ready() for breaker in breakers):
+                for breaker in breakers:
+                    breaker.allow()
+                return
+            retry_in = max(breaker.time_until_trial() for breaker in breakers)
+        raise CircuitOpenError(
+            f"Portal {urlsplit(url).netloc} is failing, next try in {retry_in:.0f}s."
+        )
+
+    @staticmethod
+    def portal_done(url: str, failure: Optional[str] = None) -> None:
+        """Records how a login against the portal went, failure None if it answered."""
+        host = urlsplit(url).netloc
+        with CircuitBreakerHandler.LOCK:
+            for breaker, kind in zip(
+                CircuitBreakerHandler.portal_breakers(url),
+                (Failure.SERVER, Failure.TIMEOUT),
+            ):
+                # A 5xx is still an answer, as far as timeouts are concerned
+                if failure is None or (kind, failure) == (
+                    Failure.TIMEOUT,
+                    Failure.SERVER,
+                ):
+                    if breaker.succeed():
+                        info(f"Breaker: {kind} circuit of {host} closed.")
+                elif kind == failure or breaker.state == BreakerState.HALF_OPEN:
+                    cooldown = breaker.fail()
+                    if cooldown is not None:
+                        warning(
+                            f"Breaker: {kind} circuit of {host} opened"
+                            f" for {cooldown:.0f}s."
+                        )
+
+    @staticmethod
+    def portal_release(url: str) -> None:
+        """Gives back the trials of a login that failed for reasons of our own."""
+        with CircuitBreakerHandler.LOCK:
+            for breaker in CircuitBreakerHandler.portal_breakers(url):
+                breaker.release()
+
+    @staticmethod
+    def account_allowed(username: str, password: str) -> bool:
+        """Returns whether the account is not quarantined, claiming a trial if due."""
+        with CircuitBreakerHandler.LOCK:
+            breaker = CircuitBreakerHandler.breaker(Failure.AUTH, username)
+            fingerprint = CircuitBreakerHandler.fingerprint(username, password)
+            if (
+                CircuitBreakerHandler.FINGERPRINTS.get(username, fingerprint)
+                != fingerprint
+            ):
+                info(f"Breaker: credentials of {username} changed, lifting quarantine.")
+                CircuitBreakerHandler.FINGERPRINTS.pop(username)
+                breaker.succeed()
+            return breaker.allow()
+
+    @staticmethod
+    def account_done(username: str, password: str, rejected: Optional[bool]) -> None:
+        """Records whether the portal rejected the account, None if it never said."""
+        with CircuitBreakerHandler.LOCK:
+            breaker = CircuitBreakerHandler.breaker(Failure.AUTH, username)
+            if rejected is None:
+                breaker.release()
+                return
+            if not rejected:
+                CircuitBreakerHandler.FINGERPRINTS.pop(username, None)
+                if breaker.succeed():
+                    info(f"Breaker: {username} is out of quarantine.")
+                return
+            CircuitBreakerHandler.FINGERPRINTS[username] = (
+                CircuitBreakerHandler.fingerprint(username, password)
+            )
+            cooldown = breaker.fail()
+            if cooldown is not None:
+                warning(f"Breaker: {username} quarantined for {cooldown:.0f}s.")
+
+    @staticmethod
+    def status() -> List[Dict[str, Any]]:
+        with CircuitBreakerHandler.LOCK:
+            return [
+                {
+                    "kind": kind,
+                    "link": link,
+                    "key": key,
+                    "state": breaker.state,
+                    "failures": breaker.failures,
+                    "retry_in": breaker.time_until_trial(),
+                }
+                for (kind, link, key), breaker in CircuitBreakerHandler.BREAKERS.items()
+            ]
@@ -0,0 +1,151 @@
+import threading
+import time
+from logging import debug, error, info
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import config
+
+LOGIND_PATH = "/org/freedesktop/login1"
+LOGIND_MANAGER_INTERFACE = "org.freedesktop.login1.Manager"
+
+# Linux only; elsewhere suspends go unnoticed between checks
+CLOCK_BOOTTIME = getattr(time, "CLOCK_BOOTTIME", time.CLOCK_MONOTONIC)
+
+
+class ClockWatcher:
+    """
+    Notices when the machine resumes from suspend or the wall clock is set,
+    so the run loops probe at once instead of sleeping out timeouts that
+    stood still while the machine was asleep.
+
+    CLOCK_MONOTONIC stops during suspend and CLOCK_BOOTTIME does not, so a
+    growing gap between them is time spent asleep, and a changing gap
+    between the wall clock and CLOCK_BOOTTIME is the clock being set.
+    logind's PrepareForSleep signal reports a resume as it happens; the
+    clocks are also compared every CLOCK_CHECK_INTERVAL for when it is not
+    there.
+    """
+
+    SLEEP_OFFSET = 0.0  # boot time minus monotonic time at the last check
+    WALL_OFFSET = 0.0  # wall time minus boot time at the last check
+    WAKES = 0  # resumes and clock changes seen
+    LAST: Dict[str, float] = {}  # slept and/or step of the last wake
+    CALLBACKS: List[Callable[[], None]] = []
+    LOCK = threading.Lock()
+    THREAD: Optional[threading.Thread] = None
+
+    @staticmethod
+    def now() -> float:
+        """
+        Returns:
+            float: Seconds since boot, counting time asleep. Unlike the
+            monotonic clock it keeps up with the portal's session timers
+            across a suspend, and unlike the wall clock it is never set.
+        """
+        return time.clock_gettime(CLOCK_BOOTTIME)
+
+    @staticmethod
+    def offsets() -> Tuple[float, float]:
+        boot = ClockWatcher.now()
+        return boot - time.monotonic(), time.time() - boot
+
+    @staticmethod
+    def on_wake(callback: Callable[[], None]) -> None:
+        """Calls callback from the watcher thread after each resume or clock change."""
+        with ClockWatcher.LOCK:
+            ClockWatcher.CALLBACKS.append(callback)
+
+    @staticmethod
+    def check(resumed: bool = False) -> bool:
+        """
+        Compares the clocks with the last check.
+        Args:
+            resumed: Whether logind has just reported a resume.
+        Returns:
+            bool: Whether the machine slept or the clock was set since.
+        """
+        sleep_offset, wall_offset = ClockWatcher.offsets()
+        with ClockWatcher.LOCK:
+            slept = sleep_offset - ClockWatcher.SLEEP_OFFSET
+            step = wall_offset - ClockWatcher.WALL_OFFSET
+            ClockWatcher.SLEEP_OFFSET = sleep_offset
+            ClockWatcher.WALL_OFFSET = wall_offset
+
+            woke: Dict[str, float] = {}
+            if resumed or slept > config.CLOCK_JUMP_THRESHOLD:
+                woke["slept"] = round(max(slept, 0), 3)
+            if abs(step) > config.CLOCK_JUMP_THRESHOLD:
+                woke["step"] = round(step, 3)
+            if not woke:
+                return False
+            ClockWatcher.LAST = woke
+            ClockWatcher.WAKES += 1
+            callbacks = list(ClockWatcher.CALLBACKS)
+
+        if "slept" in woke:
+            info(f"Clock: Resumed after {woke['slept']:.0f}s asleep.")
+        if "step" in woke:
+            info(f"Clock: Wall clock set {woke['step']:+.0f}s.")
+        for callback in callbacks:
+            callback()
+        return True
+
+    @staticmethod
+    def logind() -> Any:
+        """
+        Returns:
+            A system bus connection subscribed to logind's PrepareForSleep.
+        Raises:
+            OSError: If the system bus cannot be reached.
+        """
+        from jeepney import MatchRule
+        from jeepney.bus_messages import message_bus
+        from jeepney.io.blocking import open_dbus_connection
+
+        connection = open_dbus_connection(bus="SYSTEM")
+        rule = MatchRule(
+            type="signal",
+            interface=LOGIND_MANAGER_INTERFACE,
+            member="PrepareForSleep",
+            path=LOGIND_PATH,
+        )
+        connection.send_and_get_reply(message_bus.AddMatch(rule))
+        return connection
+
+    @staticmethod
+    def listen(connection: Any) -> None:
+        while True:
+            resumed = False
+            if connection is None:
+                time.sleep(config.CLOCK_CHECK_INTERVAL)
+            else:
+                try:
+                    message = connection.receive(timeout=config.CLOCK_CHECK_INTERVAL)
+                    # The signal's argument is True before sleeping, False after
+                    if message.body == (True,):
+                        debug("Clock: Going to sleep.")
+                    resumed = message.body == (False,)
+                except TimeoutError:
+                    pass
+                except OSError as e:
+                    error(f"Clock: Lost logind, checking the clocks only: {e}")
+                    connection = None
+            ClockWatcher.check(resumed)
+
+    @staticmethod
+    def watch() -> None:
+        """Starts watching in a background thread, once."""
+        if ClockWatcher.THREAD is not None:
+            return
+        ClockWatcher.SLEEP_OFFSET, ClockWatcher.WALL_OFFSET = ClockWatcher.offsets()
+        try:
+            connection = ClockWatcher.logind()
+            info("Clock: Watching for resume using logind.")
+        except (OSError, ImportError, ValueError) as e:
+            debug(f"Clock: logind unavailable: {e}")
+            connection = None
+            info(f"Clock: Checking for resume every {config.CLOCK_CHECK_INTERVAL}s.")
+        ClockWatcher.THREAD = threading.Thread(
+            target=ClockWatcher.listen, args=(connection,), name="clock", daemon=True
+        )
+        ClockWatcher.THREAD.start()
@@ -0,0 +1,284 @@
+import json
+import math
+import os
+import threading
+from dataclasses import dataclass
+from logging import error, info, warning
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import config
+from config import CONFIG_ENV_PREFIX, CONFIG_FILE, CONFIG_POLL_INTERVAL
+
+
+@dataclass
+class Setting:
+    kind: type  # int, float, bool, str or list (of strings)
+    minimum: Optional[float] = None  # smallest value, or length of a list
+    choices: Optional[Tuple[str, ...]] = None
+    url: bool = False  # strings, or list items, must be http(s) urls
+    live: bool = True  # applied to a running service, otherwise when it next starts
+
+
+# The tunables of config.py that can be set without editing it. Code reads
+# them as config.NAME when they are used, so that reloads take effect.
+SETTINGS: Dict[str, Setting] = {
+    "CHECK_INTERVAL": Setting(float, 1),
+    "IDLE_CHECK_INTERVAL": Setting(float, 1),
+    "EVENT_SETTLE_DELAY": Setting(float, 0),
+    "ROUTE_POLL_INTERVAL": Setting(float, 0.1),
+    "CLOCK_CHECK_INTERVAL": Setting(float, 0.1),
+    "CLOCK_JUMP_THRESHOLD": Setting(float, 0.1),
+    "SCHEDULER": Setting(str, choices=("adaptive", "fixed"), live=False),
+    "SCHEDULER_FAST_RETRY_INTERVAL": Setting(float, 0),
+    "SCHEDULER_FAST_RETRIES": Setting(int, 0),
+    "SCHEDULER_BACKOFF_BASE": Setting(float, 0),
+    "SCHEDULER_BACKOFF_MAX": Setting(float, 0),
+    "SESSION_HISTORY_SIZE": Setting(int, 1),
+    "SESSION_MIN_SAMPLES": Setting(int, 1),
+    "SESSION_MIN_CONFIDENCE": Setting(float, 0),
+    "SESSION_PREDICTION_LEAD": Setting(float, 0),
+    "SESSION_WATCH_INTERVAL": Setting(float, 0.1),
+    "BATCH_CONCURRENCY": Setting(int, 1),
+    "BATCH_RATE_LIMIT": Setting(float, 0),
+    "SINGLE_FLIGHT_TIMEOUT": Setting(float, 1),
+    "CREDENTIALS_CACHE_TTL": Setting(float, 0),
+    "WARP_STATE_TTL": Setting(float, 0),
+    "KEEPALIVE_INTERVAL": Setting(float, 1),
+    "KEEPALIVE_RETRY_INTERVAL": Setting(float, 0),
+    "KEEPALIVE_MAX_FAILURES": Setting(int, 1),
+    "PORTAL_FAILURE_THRESHOLD": Setting(int, 1),
+    "PORTAL_BREAKER_COOLDOWN": Setting(float, 0),
+    "PORTAL_BREAKER_MAX_COOLDOWN": Setting(float, 0),
+    "ACCOUNT_QUARANTINE": Setting(float, 0),
+    "ACCOUNT_QUARANTINE_MAX": Setting(float, 0),
+    "HTTP_TIMEOUT": Setting(float, 0.1),
+    "PROBE_TIMEOUT": Setting(float, 0.1),
+    "PROBE_URLS": Setting(list, 1, url=True),
+    "DNS_CACHE_TTL": Setting(float, 0),
+    "DNS_NEGATIVE_TTL": Setting(float, 0),
+    "PREWARM_GATEWAY": Setting(bool, live=False),
+    "PREWARM_TIMEOUT": Setting(float, 0.1),
+    "INTERFACES": Setting(list, live=False),
+    "FORM_PARSER": Setting(str, choices=("stream", "bs4")),
+}
+
+TRUE_WORDS = ("1", "true", "yes", "on")
+FALSE_WORDS = ("0", "false", "no", "off")
+
+
+class ConfigHandler:
+    """
+    Layers the SETTINGS of config.py with, each overriding the one before,
+    the JSON object in CONFIG_FILE, CONFIG_ENV_PREFIX<NAME> environment
+    variables and `--set NAME=VALUE` options. Every value is validated; an
+    invalid one is reported and the layer below it is used instead.
+
+    The run service reloads on SIGHUP and within CONFIG_POLL_INTERVAL of
+    CONFIG_FILE changing, keeping its sessions and loops. A file that cannot
+    be parsed, e.g. half-way through being saved, leaves the values as they
+    were.
+    """
+
+    DEFAULTS: Dict[str, Any] = {name: getattr(config, name) for name in SETTINGS}
+    FILE_VALUES: Dict[str, Any] = {}
+    OVERRIDES: Dict[str, Any] = {}  # from the command line
+    SOURCES: Dict[str, str] = {}  # where each current value came from
+    PENDING: Dict[str, Any] = {}  # values of settings that are not live, for next start
+    FILE_ID: Optional[Tuple[int, int, int]] = None
+    RELOAD = threading.Event()
+    LOCK = threading.Lock()
+    THREAD: Optional[threading.Thread] = None
+
+    @staticmethod
+    def parse_text(setting: Setting, text: str) -> Any:
+        """
+        Raises:
+            ValueError: If the text is not a value of the setting's type.
+        """
+        text = text.strip()
+        if setting.kind is bool:
+            if text.lower() in TRUE_WORDS + FALSE_WORDS:
+                return text.lower() in TRUE_WORDS
+            raise ValueError(f"{text!r} is not a boolean")
+        if setting.kind is list:
+            if text.startswith("["):
+                return json.loads(text)
+            return [item.strip() for item in text.split(",") if item.strip()]
+        return setting.kind(text)
+
+    @staticmethod
+    def parse(name: str, value: Any) -> Any:
+        """
+        Validates a value from the file, or a string from the environment or
+        the command line.
+        Raises:
+            ValueError: If the setting is unknown or the value is invalid.
+        """
+        setting = SETTINGS.get(name)
+        if setting is None:
+            raise ValueError("unknown setting")
+        if isinstance(value, str) and setting.kind is not str:
+            value = ConfigHandler.parse_text(setting, value)
+
+        number = isinstance(value, (int, float)) and not isinstance(value, bool)
+        if setting.kind is int and number and float(value).is_integer():
+            value = int(value)
+        elif setting.kind is float and number:
+            pass
+        elif not isinstance(value, setting.kind) or (
+            isinstance(value, bool) and setting.kind is not bool
+        ):
+            raise ValueError(f"{value!r} is not a {setting.kind.__name__}")
+
+        # NaN passes any comparison with the minimum, and JSON allows it
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError(f"{value!r} is not a finite number")
+        if setting.kind is list and not all(isinstance(item, str) for item in value):
+            raise ValueError(f"{value!r} is not a list of strings")
+        if setting.url:
+            for url in value if setting.kind is list else [value]:
+                parts = urlsplit(url)
+                if parts.scheme not in ("http", "https") or not parts.netloc:
+                    raise ValueError(f"{url!r} is not an http(s) url")
+        size = len(value) if setting.kind is list else value
+        if setting.minimum is not None and size < setting.minimum:
+            raise ValueError(f"{value!r} is below the minimum of {setting.minimum}")
+        if setting.choices is not None and value not in setting.choices:
+            raise ValueError(f"{value!r} is not one of {', '.join(setting.choices)}")
+        return value
+
+    @staticmethod
+    def override(assignment: str) -> None:
+        """
+        Sets a value from the command line, like HTTP_TIMEOUT=10.
+        Raises:
+            ValueError: If the assignment is malformed or the value is invalid.
+        """
+        name, separator, value = assignment.partition("=")
+        name = name.strip().upper()
+        if not separator:
+            raise ValueError(f"{assignment!r} is not NAME=VALUE")
+        try:
+            ConfigHandler.OVERRIDES[name] = ConfigHandler.parse(name, value)
+        except ValueError as e:
+            raise ValueError(f"{name}: {e}")
+
+    @staticmethod
+    def file_id() -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = CONFIG_FILE.stat()
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    @staticmethod
+    def read_file() -> Optional[Dict[str, Any]]:
+        """
+        Returns:
+            The settings in CONFIG_FILE, empty if there is none, or None if
+            it cannot be read.
+        """
+        try:
+            with open(CONFIG_FILE, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            error(f"Config: Could not read {CONFIG_FILE}: {e}")
+            return None
+        if not isinstance(data, dict):
+            error(f"Config: {CONFIG_FILE} must hold a JSON object.")
+            return None
+        # Keys like _comment are notes
+        return {name: value for name, value in data.items() if not name.startswith("_")}
+
+    @staticmethod
+    def read_env() -> Dict[str, str]:
+        return {
+            name[len(CONFIG_ENV_PREFIX) :]: value
+            for name, value in os.environ.items()
+            if name.startswith(CONFIG_ENV_PREFIX)
+        }
+
+    @staticmethod
+    def resolve() -> Tuple[Dict[str, Any], Dict[str, str]]:
+        values = dict(ConfigHandler.DEFAULTS)
+        sources = {name: "default" for name in values}
+        layers: List[Tuple[str, Dict[str, Any]]] = [
+            ("file", ConfigHandler.FILE_VALUES),
+            ("env", ConfigHandler.read_env()),
+        ]
+        for source, layer in layers:
+            for name, value in layer.items():
+                try:
+                    values[name] = ConfigHandler.parse(name, value)
+                    sources[name] = source
+                except ValueError as e:
+                    error(f"Config: Ignoring {name} from {source}: {e}")
+        for name, value in ConfigHandler.OVERRIDES.items():
+            values[name] = value
+            sources[name] = "cli"
+        return values, sources
+
+    @staticmethod
+    def load() -> None:
+        """Applies the configuration at startup."""
+        with ConfigHandler.LOCK:
+            ConfigHandler.FILE_ID = ConfigHandler.file_id()
+            ConfigHandler.FILE_VALUES = ConfigHandler.read_file() or {}
+            values, ConfigHandler.SOURCES = ConfigHandler.resolve()
+            for name, value in values.items():
+                setattr(config, name, value)
+
+    @staticmethod
+    def reload() -> None:
+        """Applies the changed values of live settings."""
+        with ConfigHandler.LOCK:
+            ConfigHandler.FILE_ID = ConfigHandler.file_id()
+            file_values = ConfigHandler.read_file()
+            if file_values is not None:
+                ConfigHandler.FILE_VALUES = file_values
+            values, sources = ConfigHandler.resolve()
+            for name, value in values.items():
+                if value == getattr(config, name):
+                    ConfigHandler.PENDING.pop(name, None)
+                    ConfigHandler.SOURCES[name] = sources[name]
+                    continue
+                if not SETTINGS[name].live:
+                    if ConfigHandler.PENDING.get(name) != value:
+                        warning(f"Config: {name} changes when the service next starts.")
+                    ConfigHandler.PENDING[name] = value
+                    continue
+                setattr(config, name, value)
+                ConfigHandler.SOURCES[name] = sources[name]
+                info(f"Config: {name} = {value!r} (from {sources[name]}).")
+
+    @staticmethod
+    def watch() -> None:
+        """Reloads whenever CONFIG_FILE changes or reload is requested, once."""
+        if ConfigHandler.THREAD is not None:
+            return
+
+        def poll() -> None:
+            while True:
+                requested = ConfigHandler.RELOAD.wait(CONFIG_POLL_INTERVAL)
+                ConfigHandler.RELOAD.clear()
+                if requested or ConfigHandler.file_id() != ConfigHandler.FILE_ID:
+                    info("Config: Reloading.")
+                    ConfigHandler.reload()
+
+        ConfigHandler.THREAD = threading.Thread(target=poll, name="config", daemon=True)
+        ConfigHandler.THREAD.start()
+
+    @staticmethod
+    def status() -> List[Dict[str, Any]]:
+        return [
+            {
+                "name": name,
+                "value": getattr(config, name),
+                "source": ConfigHandler.SOURCES.get(name, "default"),
+                "live": setting.live,
+            }
+            for name, setting in SETTINGS.items()
+        ]
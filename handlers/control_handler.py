@@ -0,0 +1,135 @@
+import json
+import os
+import socket
+import threading
+from logging import debug, error, info
+from typing import Any, Callable, Dict, Optional
+
+import config
+from config import CONTROL_SOCKET, CONTROL_TIMEOUT
+
+# Requests and responses are single lines of JSON:
+#   -> {"command": "login", "args": {"username": null, "password": null}}
+#   <- {"ok": true, "result": "logged_in"}
+#   <- {"ok": false, "error": "No session token found. Please login first."}
+
+
+class ControlHandler:
+    """
+    Local Unix socket through which CLI commands are run by the warm run
+    daemon instead of a cold process.
+    """
+
+    COMMANDS: Dict[str, Callable[..., Any]] = {}
+    SERVER: Optional[socket.socket] = None
+
+    @staticmethod
+    def register(command: str, handler: Callable[..., Any]) -> None:
+        ControlHandler.COMMANDS[command] = handler
+
+    @staticmethod
+    def timeout(command: str) -> float:
+        """Returns the seconds to wait for the answer to a command."""
+        if command != "login":
+            return CONTROL_TIMEOUT
+        # A login may first wait for one in progress, then probes and posts
+        return (
+            CONTROL_TIMEOUT
+            + config.SINGLE_FLIGHT_TIMEOUT
+            + config.PROBE_TIMEOUT
+            + 3 * config.HTTP_TIMEOUT
+        )
+
+    @staticmethod
+    def request(command: str, **args: Any) -> Optional[Dict[str, Any]]:
+        """
+        Sends a command to the run daemon.
+        Returns:
+            The response, or None if no daemon is listening.
+        Raises:
+            ValueError: If the daemon failed to run the command.
+        """
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(ControlHandler.timeout(command))
+        try:
+            client.connect(str(CONTROL_SOCKET))
+        except OSError:
+            client.close()
+            return None
+
+        try:
+            with client, client.makefile("rw") as stream:
+                stream.write(json.dumps({"command": command, "args": args}) + "\n")
+                stream.flush()
+                line = stream.readline()
+        except OSError as e:
+            raise ValueError(f"Lost connection to the run service: {e}")
+        if not line:
+            raise ValueError("The run service closed the connection.")
+
+        response = json.loads(line)
+        if not response["ok"]:
+            raise ValueError(response["error"])
+        debug(f"Control: {command} handled by the run service.")
+        return response
+
+    @staticmethod
+    def handle(connection: socket.socket) -> None:
+        with connection, connection.makefile("rw") as stream:
+            try:
+                request = json.loads(stream.readline())
+                handler = ControlHandler.COMMANDS.get(request["command"])
+                if handler is None:
+                    raise ValueError(f"Unknown command: {request['command']}")
+                response = {"ok": True, "result": handler(**request.get("args", {}))}
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            try:
+                stream.write(json.dumps(response) + "\n")
+                stream.flush()
+            except OSError as e:
+                error(f"Control: could not answer request: {e}")
+
+    @staticmethod
+    def serve() -> None:
+        """
+        Starts answering requests on CONTROL_SOCKET in the background.
+        Raises:
+            OSError: If the socket cannot be created.
+        """
+        if CONTROL_SOCKET.exists():
+            # Left behind by a daemon that did not exit cleanly
+            CONTROL_SOCKET.unlink()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            server.bind(str(CONTROL_SOCKET))
+        finally:
+            os.umask(old_umask)
+        server.listen()
+        ControlHandler.SERVER = server
+
+        def accept() -> None:
+            while True:
+                try:
+                    connection, _ = server.accept()
+                except OSError:
+                    return  # closed
+                threading.Thread(
+                    target=ControlHandler.handle, args=(connection,), daemon=True
+                ).start()
+
+        threading.Thread(target=accept, daemon=True).start()
+        info(f"Control socket listening at {CONTROL_SOCKET}")
+
+    @staticmethod
+    def close() -> None:
+        if ControlHandler.SERVER is not None:
+            try:
+                # Wakes up the accepting thread
+                ControlHandler.SERVER.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            ControlHandler.SERVER.close()
+            ControlHandler.SERVER = None
+            CONTROL_SOCKET.unlink(missing_ok=True)
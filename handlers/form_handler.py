@@ -0,0 +1,180 @@
+import json
+import os
+import tempfile
+import threading
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+from logging import debug, info
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import FORM_CACHE_FILE
+
+# Marks a hidden field whose value is the query string of the redirect url,
+# e.g. the FortiGate "magic" value.
+QUERY_FIELD = "query"
+
+
+class FormCacheHandler:
+    """
+    Caches the login form of each portal host as a template, so that a login
+    can go straight from the probe redirect to the POST without fetching and
+    parsing the login page.
+    """
+
+    TEMPLATES: Optional[Dict[str, Dict[str, Any]]] = None
+    LOCK = threading.RLock()  # batch logins learn forms from many threads
+
+    @staticmethod
+    def load() -> Dict[str, Dict[str, Any]]:
+        if FormCacheHandler.TEMPLATES is None:
+            try:
+                with open(FORM_CACHE_FILE, "r") as f:
+                    FormCacheHandler.TEMPLATES = json.load(f)["templates"]
+            except:
+                FormCacheHandler.TEMPLATES = {}
+        return FormCacheHandler.TEMPLATES
+
+    @staticmethod
+    def save() -> None:
+        # Written aside and renamed, so a crash never leaves a truncated cache
+        with FormCacheHandler.LOCK:
+            templates = dict(FormCacheHandler.load())
+            fd, tmp_path = tempfile.mkstemp(
+                dir=FORM_CACHE_FILE.parent, prefix=f".{FORM_CACHE_FILE.name}."
+            )
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(
+                        {
+                            "_comment": "This file is auto-generated by IIITK Portal Loginator",
+                            "templates": templates,
+                        },
+                        f,
+                    )
+                os.replace(tmp_path, FORM_CACHE_FILE)
+            except BaseException as e:
+                os.unlink(tmp_path)
+                raise e
+
+    @staticmethod
+    def learn(
+        redirect_url: str, login_page_url: str, form_action: str, form_data: Dict[str, str]
+    ) -> None:
+        """Stores the parsed login form as the template for the portal host."""
+        redirect = urlsplit(redirect_url)
+        static: Dict[str, str] = {}
+        derived: Dict[str, str] = {}
+        for name, value in form_data.items():
+            if redirect.query and value == redirect.query:
+                derived[name] = QUERY_FIELD
+            else:
+                static[name] = value
+
+        with FormCacheHandler.LOCK:
+            FormCacheHandler.load()[redirect.netloc] = {
+                "path": redirect.path,
+                "post_url": urljoin(login_page_url, form_action),
+                "static": static,
+                "derived": derived,
+            }
+            FormCacheHandler.save()
+        info(f"Learned login form template for portal: {redirect.netloc}")
+
+    @staticmethod
+    def get(redirect_url: str) -> Optional[Tuple[str, Dict[str, str]]]:
+        """
+        Builds the login form from the cached template for the redirect url.
+        Returns:
+            The absolute POST url and the hidden form fields, or None if there
+            is no template or it does not fit the redirect url.
+        """
+        redirect = urlsplit(redirect_url)
+        template = FormCacheHandler.load().get(redirect.netloc)
+        if template is None:
+            return None
+        if template["path"] != redirect.path:
+            debug(f"Login form template path mismatch: {redirect.path}")
+            return None
+
+        form_data: Dict[str, str] = dict(template["static"])
+        for name, source in template["derived"].items():
+            if source != QUERY_FIELD or not redirect.query:
+                debug(f"Cannot derive login form field: {name}")
+                return None
+            form_data[name] = redirect.query
+        return template["post_url"], form_data
+
+    @staticmethod
+    def evict(redirect_url: str) -> None:
+        host = urlsplit(redirect_url).netloc
+        with FormCacheHandler.LOCK:
+            if FormCacheHandler.load().pop(host, None) is None:
+                return
+            FormCacheHandler.save()
+        info(f"Evicted login form template for portal: {host}")
+
+
+class FormParsed(Exception):
+    """Raised by LoginFormExtractor to stop parsing once the form has ended."""
+
+
+class LoginFormExtractor(HTMLParser):
+    """
+    Streaming extractor for the action and hidden inputs of the first form.
+    Parsing stops at the end of the first form, so the rest of the page is
+    never looked at.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.found = False
+        self.done = False
+        self.depth = 0
+        self.action: Optional[str] = None
+        self.data: Dict[str, str] = {}
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        attributes = {name: value or "" for name, value in attrs}
+        if tag == "form":
+            if not self.found:
+                self.found = True
+                self.action = attributes.get("action")
+            self.depth += 1
+        elif tag == "input" and self.depth > 0:
+            if attributes.get("type") == "hidden":
+                name = attributes.get("name")
+                if name:
+                    self.data[name] = attributes.get("value", "")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "form" and self.depth > 0:
+            self.depth -= 1
+            if self.depth == 0:
+                self.done = True
+                raise FormParsed()
+
+    def feed(self, data: str) -> None:
+        if self.done:
+            return
+        try:
+            super().feed(data)
+        except FormParsed:
+            pass
+
+    def close(self) -> None:
+        if self.done:
+            return
+        try:
+            super().close()
+        except FormParsed:
+            pass
+
+    def result(self) -> Tuple[str, Dict[str, str]]:
+        """
+        Returns:
+            The form action and the hidden input fields.
+        """
+        self.close()
+        assert self.found
+        assert isinstance(self.action, str)
+        return self.action, self.data
@@ -0,0 +1,304 @@
+import codecs
+import ipaddress
+import socket
+import threading
+import requests
+from collections import OrderedDict
+from time import monotonic
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, HTTPError, NameResolutionError
+from urllib3.util.connection import allowed_gai_family
+from logging import debug, info, warning
+from typing import Any, Dict, List, Match, Optional, Pattern, Tuple, Union
+
+import config
+from config import (
+    DNS_CACHE_SIZE,
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_MAXSIZE,
+    STREAM_CHUNK_SIZE,
+    STREAM_MAX_BYTES,
+)
+from handlers.link_handler import LinkHandler
+
+# Longest stretch of text a match may span across chunk boundaries
+STREAM_OVERLAP = 4096
+
+# Addresses of a host, or why they could not be found
+DnsAnswer = Union[List[str], socket.gaierror]
+
+
+class DnsCache:
+    """
+    Caches host name lookups for the HTTP layer, so that probes and logins
+    do not wait on a slow or intercepted resolver while behind the portal.
+
+    Answers are kept for DNS_CACHE_TTL and failures for DNS_NEGATIVE_TTL.
+    getaddrinfo does not expose record TTLs, so these are fixed. Entries
+    belong to the network of the current interface (see LinkHandler) and are
+    cleared when it changes, leaving those of other interfaces alone.
+    """
+
+    # (link, host): (expiry, addresses or the lookup error)
+    ENTRIES: "OrderedDict[Tuple[Optional[str], str], Tuple[float, DnsAnswer]]" = (
+        OrderedDict()
+    )
+    LOCK = threading.Lock()
+
+    @staticmethod
+    def resolve(host: str) -> List[str]:
+        """
+        Returns:
+            The addresses of the host, in the resolver's order.
+        Raises:
+            socket.gaierror: If the host cannot be resolved.
+        """
+        try:
+            ipaddress.ip_address(host)
+            return [host]  # Already an address, e.g. the portal gateway
+        except ValueError:
+            pass
+
+        with DnsCache.LOCK:
+            entry = DnsCache.ENTRIES.get((LinkHandler.current(), host))
+        if entry is not None and monotonic() < entry[0]:
+            debug(f"DNS: cached answer for {host}.")
+            if isinstance(entry[1], socket.gaierror):
+                raise entry[1]
+            return entry[1]
+
+        try:
+            infos = socket.getaddrinfo(
+                host, None, allowed_gai_family(), socket.SOCK_STREAM
+            )
+            addresses = list(dict.fromkeys(str(info[4][0]) for info in infos))
+            DnsCache.put(host, config.DNS_CACHE_TTL, addresses)
+            return addresses
+        except socket.gaierror as e:
+            DnsCache.put(host, config.DNS_NEGATIVE_TTL, e)
+            raise e
+
+    @staticmethod
+    def put(host: str, ttl: float, answer: DnsAnswer) -> None:
+        key = (LinkHandler.current(), host)
+        with DnsCache.LOCK:
+            DnsCache.ENTRIES[key] = (monotonic() + ttl, answer)
+            DnsCache.ENTRIES.move_to_end(key)
+            while len(DnsCache.ENTRIES) > DNS_CACHE_SIZE:
+                DnsCache.ENTRIES.popitem(last=False)
+
+    @staticmethod
+    def evict(host: str) -> None:
+        with DnsCache.LOCK:
+            DnsCache.ENTRIES.pop((LinkHandler.current(), host), None)
+
+    @staticmethod
+    def clear() -> None:
+        link = LinkHandler.current()
+        with DnsCache.LOCK:
+            for key in [key for key in DnsCache.ENTRIES if key[0] == link]:
+                del DnsCache.ENTRIES[key]
+        debug("DNS: cache cleared.")
+
+
+class CachedDnsConnectionMixin:
+    """Resolves through DnsCache, then connects to each address in turn."""
+
+    def _new_conn(self) -> socket.socket:
+        host = self._dns_host
+        try:
+            addresses = DnsCache.resolve(host)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+
+        try:
+            for index, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except ConnectTimeoutError:  # also raised when refused
+                    if index == len(addresses) - 1:
+                        # The cached addresses may be stale
+                        DnsCache.evict(host)
+                        raise
+        finally:
+            self._dns_host = host
+
+
+class CachedDnsHTTPConnection(CachedDnsConnectionMixin, HTTPConnection):
+    pass
+
+
+class CachedDnsHTTPSConnection(CachedDnsConnectionMixin, HTTPSConnection):
+    pass
+
+
+class CachedDnsHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CachedDnsHTTPConnection
+
+
+class CachedDnsHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CachedDnsHTTPSConnection
+
+
+class CachedDnsAdapter(HTTPAdapter):
+    def __init__(
+        self, *args: Any, socket_options: Optional[List[Any]] = None, **kwargs: Any
+    ) -> None:
+        # Extra options for every socket, e.g. binding it to an interface
+        self.socket_options = socket_options or []
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        if self.socket_options:
+            kwargs["socket_options"] = [
+                *HTTPConnection.default_socket_options,
+                *self.socket_options,
+            ]
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CachedDnsHTTPConnectionPool,
+            "https": CachedDnsHTTPSConnectionPool,
+        }
+
+
+class HttpHandler:
+    """
+    Long-lived, connection-pooled HTTP session shared by the whole login flow.
+
+    Connections are kept alive per host, so the probe, the login form fetch,
+    the login POST and the logout reuse warm sockets instead of paying for a
+    new TCP handshake on every step.
+
+    Each interface (see LinkHandler) has its own session, whose sockets are
+    bound to it.
+    """
+
+    SESSIONS: Dict[Optional[str], requests.Session] = {}
+    LOCK = threading.Lock()
+
+    @staticmethod
+    def get_session() -> requests.Session:
+        link = LinkHandler.current()
+        with HttpHandler.LOCK:
+            if link not in HttpHandler.SESSIONS:
+                session = requests.Session()
+                adapter = CachedDnsAdapter(
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                    socket_options=LinkHandler.socket_options(link),
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                HttpHandler.SESSIONS[link] = session
+                debug(f"HTTP session created{f' on {link}' if link else ''}.")
+            return HttpHandler.SESSIONS[link]
+
+    @staticmethod
+    def reset() -> None:
+        """
+        Drops all pooled connections of the current interface, e.g. after the
+        network has changed.
+        """
+        link = LinkHandler.current()
+        with HttpHandler.LOCK:
+            session = HttpHandler.SESSIONS.pop(link, None)
+            if session is not None:
+                session.close()
+                info("HTTP session reset.")
+
+    @staticmethod
+    def prewarm(url: str) -> None:
+        """
+        Opens a connection to the host of the url in the background and parks
+        it in the pool, so the first request to it skips the TCP handshake.
+        """
+        adapter = HttpHandler.get_session().get_adapter(url)
+
+        def connect() -> None:
+            try:
+                pool = adapter.poolmanager.connection_from_url(url)
+                connection = pool._get_conn()
+                connection.timeout = config.PREWARM_TIMEOUT
+                try:
+                    connection.connect()
+                    debug(f"Pre-opened a connection to {pool.host}:{pool.port}.")
+                except (OSError, HTTPError) as e:
+                    debug(f"Could not pre-open a connection to {pool.host}: {e}")
+                    connection.close()
+                pool._put_conn(connection)
+            except Exception as e:
+                debug(f"Could not pre-open a connection for {url}: {e}")
+
+        threading.Thread(target=connect, daemon=True).start()
+
+    @staticmethod
+    def request(method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Raises:
+            RequestException: If the request fails.
+        """
+        kwargs.setdefault("timeout", config.HTTP_TIMEOUT)
+        try:
+            return HttpHandler.get_session().request(method, url, **kwargs)
+        except (ConnectionError, Timeout) as e:
+            # Pooled sockets are likely stale, start afresh on the next request
+            HttpHandler.reset()
+            raise e
+
+    @staticmethod
+    def get(url: str, **kwargs) -> requests.Response:
+        """
+        Raises:
+            RequestException: If the request fails.
+        """
+        return HttpHandler.request("GET", url, **kwargs)
+
+    @staticmethod
+    def post(url: str, **kwargs) -> requests.Response:
+        """
+        Raises:
+            RequestException: If the request fails.
+        """
+        return HttpHandler.request("POST", url, **kwargs)
+
+    @staticmethod
+    def search(
+        resp: requests.Response,
+        pattern: Pattern[str],
+        max_bytes: int = STREAM_MAX_BYTES,
+    ) -> Tuple[Optional[Match[str]], str]:
+        """
+        Reads a streamed response body in chunks until the pattern matches, the
+        body ends or max_bytes have been read, then closes the response.
+        Returns:
+            The match, if any, and the text read so far.
+        Raises:
+            RequestException: If reading the body fails.
+        """
+        decoder = codecs.getincrementaldecoder(resp.encoding or "utf-8")(
+            errors="replace"
+        )
+        text = ""
+        read = 0
+        try:
+            for chunk in resp.iter_content(STREAM_CHUNK_SIZE):
+                read += len(chunk)
+                start = max(len(text) - STREAM_OVERLAP, 0)
+                text += decoder.decode(chunk)
+                match = pattern.search(text, start)
+                # A match touching the end of the text may still grow with the next chunk
+                if match is not None and match.end() < len(text):
+                    debug(f"Stopped reading {resp.url} after {read} bytes.")
+                    return match, text
+                if read >= max_bytes:
+                    warning(f"Stopped reading {resp.url} at the {max_bytes} bytes cap.")
+                    break
+            else:
+                text += decoder.decode(b"", final=True)
+            return pattern.search(text), text
+        finally:
+            resp.close()
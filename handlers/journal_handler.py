@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+from collections import deque
+from time import time
+from logging import error
+from pathlib import Path
+from typing import Any, Collection, Deque, Dict, List, Optional
+
+from config import JOURNAL_FILE, JOURNAL_BUFFER_SIZE, JOURNAL_MAX_BYTES, JOURNAL_ROTATIONS
+from handlers.link_handler import LinkHandler
+
+
+class Event:
+    """Kinds of journal events."""
+
+    PROBE = "probe"
+    LOGIN = "login"
+    KEEPALIVE = "keepalive"
+    LOGOUT = "logout"
+    NETWORK = "network"
+    CLOCK = "clock"  # resume from suspend or wall clock change
+
+    ALL = (PROBE, LOGIN, KEEPALIVE, LOGOUT, NETWORK, CLOCK)
+
+
+class JournalHandler:
+    """
+    History of probes, logins, keepalives and network changes.
+
+    Events are kept in a bounded in-memory ring buffer and appended, one
+    compact JSON line each, to JOURNAL_FILE, which is rotated into
+    JOURNAL_FILE.1 .. JOURNAL_FILE.<JOURNAL_ROTATIONS> once it grows past
+    JOURNAL_MAX_BYTES. Memory and disk use stay bounded however long the
+    daemon runs.
+    """
+
+    EVENTS: Deque[Dict[str, Any]] = deque(maxlen=JOURNAL_BUFFER_SIZE)
+    LOCK = threading.Lock()
+
+    @staticmethod
+    def files() -> List[Path]:
+        """Returns the journal files, oldest first."""
+        rotated = [
+            JOURNAL_FILE.with_name(f"{JOURNAL_FILE.name}.{index}")
+            for index in range(JOURNAL_ROTATIONS, 0, -1)
+        ]
+        return [path for path in [*rotated, JOURNAL_FILE] if path.exists()]
+
+    @staticmethod
+    def rotate() -> None:
+        for index in range(JOURNAL_ROTATIONS, 0, -1):
+            source = JOURNAL_FILE.with_name(
+                f"{JOURNAL_FILE.name}.{index - 1}" if index > 1 else JOURNAL_FILE.name
+            )
+            if source.exists():
+                os.replace(source, JOURNAL_FILE.with_name(f"{JOURNAL_FILE.name}.{index}"))
+
+    @staticmethod
+    def record(kind: str, **fields: Any) -> Dict[str, Any]:
+        """
+        Records an event now, tagged with the current interface if any.
+        Float fields are rounded to milliseconds.
+        """
+        event: Dict[str, Any] = {"t": round(time(), 3), "e": kind}
+        link = LinkHandler.current()
+        if link is not None:
+            event["link"] = link
+        for key, value in fields.items():
+            if isinstance(value, float):
+                value = round(value, 3)
+            elif isinstance(value, dict):
+                value = {
+                    k: round(v, 3) if isinstance(v, float) else v for k, v in value.items()
+                }
+            event[key] = value
+
+        line = json.dumps(event, separators=(",", ":")) + "\n"
+        with JournalHandler.LOCK:
+            JournalHandler.EVENTS.append(event)
+            try:
+                if (
+                    JournalHandler.size() + len(line) > JOURNAL_MAX_BYTES
+                    and JOURNAL_ROTATIONS > 0
+                ):
+                    JournalHandler.rotate()
+                # Opened per event so that a rotation by another process is seen
+                with open(JOURNAL_FILE, "a") as f:
+                    f.write(line)
+            except OSError as e:
+                error(f"Could not write the journal: {e}")
+        return event
+
+    @staticmethod
+    def size() -> int:
+        try:
+            return JOURNAL_FILE.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def read(path: Path) -> List[Dict[str, Any]]:
+        events = []
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    pass  # torn line, e.g. after a crash mid-write
+        return events
+
+    @staticmethod
+    def load() -> None:
+        """Fills the ring buffer with the most recent events on disk."""
+        lines: Deque[str] = deque(maxlen=JOURNAL_BUFFER_SIZE)
+        try:
+            # Newest files first, stopping once the buffer would be full
+            for path in reversed(JournalHandler.files()):
+                file_lines = path.read_text().splitlines()
+                lines.extendleft(reversed(file_lines[-(lines.maxlen - len(lines)) :]))
+                if len(lines) == lines.maxlen:
+                    break
+        except OSError as e:
+            error(f"Could not read the journal: {e}")
+
+        events = []
+        for line in lines:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                pass
+        with JournalHandler.LOCK:
+            JournalHandler.EVENTS.clear()
+            JournalHandler.EVENTS.extend(events)
+
+    @staticmethod
+    def query(
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        kinds: Optional[Collection[str]] = None,
+        link: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns the events recorded between since and until (unix times,
+        inclusive), oldest first, optionally only those of one interface.
+        Served from memory when the ring buffer reaches back far enough,
+        otherwise read from the journal files.
+        """
+        with JournalHandler.LOCK:
+            buffered = list(JournalHandler.EVENTS)
+        if buffered and since is not None and since >= buffered[0]["t"]:
+            events = buffered
+        else:
+            events = []
+            try:
+                for path in JournalHandler.files():
+                    events.extend(JournalHandler.read(path))
+            except OSError as e:
+                error(f"Could not read the journal: {e}")
+
+        return [
+            event
+            for event in events
+            if (since is None or event["t"] >= since)
+            and (until is None or event["t"] <= until)
+            and (not kinds or event["e"] in kinds)
+            and (link is None or event.get("link") == link)
+        ]
@@ -0,0 +1,109 @@
+from math import inf
+from requests.exceptions import RequestException
+from logging import error, info, warning
+from typing import Dict, Optional
+
+import config
+from handlers.clock_handler import ClockWatcher
+from handlers.http_handler import HttpHandler
+from handlers.journal_handler import Event, JournalHandler
+from handlers.link_handler import LinkHandler
+from handlers.session_handler import LoginResult, SessionHandler
+
+
+class KeepaliveHandler:
+    """
+    Refreshes the portal session with the stored keepalive token before it
+    expires, so the run loop rarely has to go through a full login.
+
+    The schedule is kept per interface, see LinkHandler.
+    """
+
+    NEXT_AT: Dict[Optional[str], float] = {}  # boot time of the next keepalive
+    FAILURES: Dict[Optional[str], int] = {}
+
+    @staticmethod
+    def schedule(delay: Optional[float] = None) -> None:
+        if delay is None:
+            delay = config.KEEPALIVE_INTERVAL
+        KeepaliveHandler.NEXT_AT[LinkHandler.current()] = ClockWatcher.now() + delay
+
+    @staticmethod
+    def advance(delay: float) -> None:
+        """Brings a scheduled keepalive forward to at most delay from now."""
+        link = LinkHandler.current()
+        next_at = KeepaliveHandler.NEXT_AT.get(link, inf)
+        if next_at < inf:
+            KeepaliveHandler.NEXT_AT[link] = min(next_at, ClockWatcher.now() + delay)
+
+    @staticmethod
+    def cancel() -> None:
+        KeepaliveHandler.NEXT_AT[LinkHandler.current()] = inf
+        KeepaliveHandler.FAILURES[LinkHandler.current()] = 0
+
+    @staticmethod
+    def time_until_due() -> float:
+        next_at = KeepaliveHandler.NEXT_AT.get(LinkHandler.current(), inf)
+        return max(next_at - ClockWatcher.now(), 0)
+
+    @staticmethod
+    def keepalive(ip: str, token: str) -> None:
+        """
+        Raises:
+            RequestException: If the portal could not be reached.
+            ValueError: If the portal rejected the token.
+        """
+        resp = HttpHandler.get(f"http://{ip}/keepalive?{token}")
+        if resp.status_code >= 500:
+            resp.close()
+            raise RequestException(f"Keepalive failed with status {resp.status_code}.")
+        # A live session answers with a page that refreshes the same keepalive url
+        if resp.status_code >= 400 or token not in resp.text:
+            raise ValueError("Keepalive token was rejected by the portal.")
+        info("Session kept alive.")
+
+    @staticmethod
+    def run_if_due() -> None:
+        """
+        Refreshes the session if due. Transient failures are retried with
+        backoff; a rejected token falls back to a full login.
+        """
+        if KeepaliveHandler.time_until_due() > 0:
+            return
+        link = LinkHandler.current()
+
+        try:
+            ip, token = SessionHandler.get_session_details()
+        except ValueError:
+            KeepaliveHandler.cancel()
+            return
+
+        try:
+            KeepaliveHandler.keepalive(ip, token)
+            JournalHandler.record(Event.KEEPALIVE, result="ok")
+            KeepaliveHandler.FAILURES[link] = 0
+            KeepaliveHandler.schedule()
+        except RequestException as e:
+            JournalHandler.record(Event.KEEPALIVE, result="failed", error=str(e))
+            failures = KeepaliveHandler.FAILURES.get(link, 0) + 1
+            KeepaliveHandler.FAILURES[link] = failures
+            if failures >= config.KEEPALIVE_MAX_FAILURES:
+                error(f"Keepalive: giving up after {failures} failures.")
+                KeepaliveHandler.cancel()
+                return
+            delay = min(
+                config.KEEPALIVE_RETRY_INTERVAL * 2 ** (failures - 1),
+                config.KEEPALIVE_INTERVAL,
+            )
+            warning(f"Keepalive failed, retrying in {delay}s: {e}")
+            KeepaliveHandler.schedule(delay)
+        except ValueError as e:
+            JournalHandler.record(Event.KEEPALIVE, result="rejected")
+            warning(f"Keepalive: {e}")
+            KeepaliveHandler.cancel()
+            result = SessionHandler.login(username=None, password=None)
+            # Otherwise the token stays stale; the run loop's probes take over
+            if result == LoginResult.LOGGED_IN:
+                KeepaliveHandler.schedule()
+            else:
+                warning(f"Keepalive: login after rejection gave {result}.")
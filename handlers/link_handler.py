@@ -0,0 +1,71 @@
+import socket
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+
+class LinkHandler:
+    """
+    The network interface the current thread works on, so that one daemon
+    can run an independent probe, login and keepalive state machine per
+    uplink. None is the default route, as with a single link.
+
+    HTTP traffic for an interface is bound to it with SO_BINDTODEVICE, and
+    per-session files get the interface name as a suffix.
+    """
+
+    CURRENT = threading.local()
+
+    @staticmethod
+    def current() -> Optional[str]:
+        return getattr(LinkHandler.CURRENT, "link", None)
+
+    @staticmethod
+    @contextmanager
+    def use(link: Optional[str]) -> Iterator[None]:
+        """Runs the enclosed block on the given interface."""
+        previous = LinkHandler.current()
+        LinkHandler.CURRENT.link = link
+        try:
+            yield
+        finally:
+            LinkHandler.CURRENT.link = previous
+
+    @staticmethod
+    def path(path: Path, link: Optional[str] = None) -> Path:
+        """Returns the per-interface variant of a state file."""
+        link = link if link is not None else LinkHandler.current()
+        return path if link is None else path.with_name(f"{path.name}.{link}")
+
+    @staticmethod
+    def index(link: str) -> int:
+        """
+        Raises:
+            OSError: If there is no such interface.
+        """
+        return socket.if_nametoindex(link)
+
+    @staticmethod
+    def socket_options(link: Optional[str] = None) -> List[Tuple[int, int, object]]:
+        """
+        Returns:
+            Extra socket options binding connections to the interface.
+        """
+        link = link if link is not None else LinkHandler.current()
+        if link is None:
+            return []
+        # SO_BINDTODEVICE is Linux only and needs CAP_NET_RAW before 5.7
+        return [(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, link.encode())]
+
+    @staticmethod
+    def check_bind(link: str) -> None:
+        """
+        Binds a socket to the interface as every request on it will.
+        Raises:
+            PermissionError: If the process may not bind to interfaces.
+            OSError: If binding fails otherwise.
+        """
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            for option in LinkHandler.socket_options(link):
+                sock.setsockopt(*option)
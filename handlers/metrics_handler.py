@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter, time
+from logging import debug, error
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from config import METRICS_FILE, METRICS_BUCKETS, METRICS_SAMPLES
+
+
+class Histogram:
+    """Latency histogram with cumulative buckets and a window of recent samples."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.buckets = [0] * len(METRICS_BUCKETS)
+        self.samples: Deque[float] = deque(maxlen=METRICS_SAMPLES)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.sum += seconds
+        index = bisect_left(METRICS_BUCKETS, seconds)
+        if index < len(self.buckets):
+            self.buckets[index] += 1
+        self.samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": self.buckets,
+            "samples": list(self.samples),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+        }
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> "Histogram":
+        histogram = Histogram()
+        histogram.count = data["count"]
+        histogram.sum = data["sum"]
+        histogram.buckets = list(data["buckets"])
+        histogram.samples.extend(data["samples"])
+        return histogram
+
+
+class MetricsHandler:
+    """
+    Times the phases of the login pipeline and the run loop into in-memory
+    histograms, exported as a JSON snapshot or a Prometheus textfile.
+    """
+
+    HISTOGRAMS: Dict[str, Histogram] = {}
+    LOCK = threading.Lock()
+    CAPTURE = threading.local()
+
+    @staticmethod
+    def observe(phase: str, seconds: float) -> None:
+        with MetricsHandler.LOCK:
+            histogram = MetricsHandler.HISTOGRAMS.setdefault(phase, Histogram())
+            histogram.observe(seconds)
+        phases = getattr(MetricsHandler.CAPTURE, "phases", None)
+        if phases is not None:
+            phases[phase] = phases.get(phase, 0) + seconds
+        debug(f"Metrics: {phase} took {seconds:.3f}s")
+
+    @staticmethod
+    @contextmanager
+    def span(phase: str) -> Iterator[None]:
+        """Times the enclosed block, whether or not it raises."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            MetricsHandler.observe(phase, perf_counter() - start)
+
+    @staticmethod
+    @contextmanager
+    def capture() -> Iterator[Dict[str, float]]:
+        """Collects the phases this thread observes within the block."""
+        phases: Dict[str, float] = {}
+        previous = getattr(MetricsHandler.CAPTURE, "phases", None)
+        MetricsHandler.CAPTURE.phases = phases
+        try:
+            yield phases
+        finally:
+            MetricsHandler.CAPTURE.phases = previous
+
+    @staticmethod
+    def write_atomic(path: Path, content: str) -> None:
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_text(content)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def save(textfile: Optional[Path] = None) -> None:
+        """Writes the JSON snapshot and, if given, the Prometheus textfile."""
+        with MetricsHandler.LOCK:
+            snapshot = {
+                name: histogram.to_dict()
+                for name, histogram in MetricsHandler.HISTOGRAMS.items()
+            }
+        try:
+            MetricsHandler.write_atomic(
+                METRICS_FILE,
+                json.dumps(
+                    {
+                        "_comment": "This file is auto-generated by IIITK Portal Loginator",
+                        "updated": time(),
+                        "histograms": snapshot,
+                    }
+                ),
+            )
+            if textfile is not None:
+                histograms = {
+                    name: Histogram.from_dict(data) for name, data in snapshot.items()
+                }
+                MetricsHandler.write_atomic(
+                    textfile, MetricsHandler.render_prometheus(histograms)
+                )
+        except OSError as e:
+            error(f"Could not save metrics: {e}")
+
+    @staticmethod
+    def load() -> Dict[str, Histogram]:
+        """
+        Loads the snapshot saved by the run daemon.
+        Raises:
+            ValueError: If there is no snapshot.
+        """
+        try:
+            with open(METRICS_FILE, "r") as f:
+                data = json.load(f)["histograms"]
+        except:
+            raise ValueError("No metrics found. Is the run service running?")
+        return {name: Histogram.from_dict(item) for name, item in data.items()}
+
+    @staticmethod
+    def render_prometheus(histograms: Dict[str, Histogram]) -> str:
+        lines: List[str] = [
+            "# HELP loginator_phase_seconds Duration of the login pipeline phases.",
+            "# TYPE loginator_phase_seconds histogram",
+        ]
+        for name, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(METRICS_BUCKETS, histogram.buckets):
+                cumulative += count
+                lines.append(
+                    f'loginator_phase_seconds_bucket{{phase="{name}",le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f'loginator_phase_seconds_bucket{{phase="{name}",le="+Inf"}} {histogram.count}'
+            )
+            lines.append(f'loginator_phase_seconds_sum{{phase="{name}"}} {histogram.sum}')
+            lines.append(f'loginator_phase_seconds_count{{phase="{name}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
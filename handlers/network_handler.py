@@ -0,0 +1,280 @@
+import os
+import select
+import socket
+import struct
+import threading
+from abc import ABC, abstractmethod
+from time import monotonic
+from logging import debug, info
+from typing import Optional
+
+import config
+from config import ROUTE_FILE
+
+# rtnetlink multicast groups, see linux/rtnetlink.h
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+
+RTM_MESSAGES = {
+    16: "NEWLINK",
+    17: "DELLINK",
+    20: "NEWADDR",
+    21: "DELADDR",
+    24: "NEWROUTE",
+    25: "DELROUTE",
+}
+
+RTM_ROUTE_MESSAGES = (24, 25)
+RTA_OIF = 4  # route attribute holding the output interface index
+
+NLMSG_HEADER = struct.Struct("=LHHLL")
+IF_INDEX = struct.Struct("=i")  # offset 4 in both ifinfomsg and ifaddrmsg
+RTMSG_SIZE = 12
+RTATTR_HEADER = struct.Struct("=HH")
+
+
+class NetworkEventSource(ABC):
+    """Source of network change events, waited on by the NetworkWatcher."""
+
+    name = "base"
+
+    def __init__(self) -> None:
+        # Written to by wake(), so that another thread can cut wait() short
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+
+    @abstractmethod
+    def wait(self, timeout: float) -> bool:
+        """
+        Blocks until a network change is observed, wake() is called or the
+        timeout elapses.
+        Returns:
+            bool: True if a change was observed or the source was woken.
+        """
+
+    def wake(self) -> None:
+        try:
+            os.write(self.wake_w, b"\0")
+        except BlockingIOError:
+            pass  # a wake is already pending
+
+    def drain(self) -> bool:
+        try:
+            while os.read(self.wake_r, 64):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def sleep(self, timeout: float) -> bool:
+        """
+        Returns:
+            bool: True if woken before the timeout elapsed.
+        """
+        readable, _, _ = select.select([self.wake_r], [], [], max(timeout, 0))
+        return self.drain() if readable else False
+
+    def close(self) -> None:
+        os.close(self.wake_r)
+        os.close(self.wake_w)
+
+
+class RtnetlinkEventSource(NetworkEventSource):
+    """
+    Listens for kernel link, address and route change events, optionally
+    only those of one interface.
+    """
+
+    name = "rtnetlink"
+
+    def __init__(self, interface: Optional[str] = None) -> None:
+        """
+        Raises:
+            OSError: If the netlink socket cannot be opened or there is no
+                such interface.
+        """
+        self.index = socket.if_nametoindex(interface) if interface else None
+        super().__init__()
+        groups = RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_IFADDR
+        self.sock = socket.socket(
+            socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE
+        )
+        try:
+            self.sock.bind((0, groups))
+        except OSError as e:
+            self.sock.close()
+            super().close()
+            raise e
+        self.sock.setblocking(False)
+
+    def wait(self, timeout: float) -> bool:
+        readable, _, _ = select.select(
+            [self.sock, self.wake_r], [], [], max(timeout, 0)
+        )
+        if not readable:
+            return False
+        changed = self.wake_r in readable and self.drain()
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(data):
+                length, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+                if msg_type in RTM_MESSAGES and self.concerns(
+                    msg_type, data[offset + NLMSG_HEADER.size : offset + length]
+                ):
+                    debug(f"Netlink event: {RTM_MESSAGES[msg_type]}")
+                    changed = True
+                if length < NLMSG_HEADER.size:
+                    break
+                offset += (length + 3) & ~3
+        return changed
+
+    def concerns(self, msg_type: int, payload: bytes) -> bool:
+        """Returns whether a message is about the watched interface."""
+        if self.index is None:
+            return True
+        if msg_type not in RTM_ROUTE_MESSAGES:
+            return (
+                len(payload) >= 8 and IF_INDEX.unpack_from(payload, 4)[0] == self.index
+            )
+        offset = RTMSG_SIZE
+        while offset + RTATTR_HEADER.size <= len(payload):
+            length, kind = RTATTR_HEADER.unpack_from(payload, offset)
+            if length < RTATTR_HEADER.size:
+                break
+            if kind == RTA_OIF and length >= 8:
+                return IF_INDEX.unpack_from(payload, offset + 4)[0] == self.index
+            offset += (length + 3) & ~3
+        return False
+
+    def close(self) -> None:
+        self.sock.close()
+        super().close()
+
+
+class ProcRouteEventSource(NetworkEventSource):
+    """
+    Polls the kernel routing table and reports when it differs, optionally
+    only in the routes of one interface.
+    """
+
+    name = "proc_route"
+
+    def __init__(self, interface: Optional[str] = None) -> None:
+        """
+        Raises:
+            OSError: If the routing table cannot be read.
+        """
+        self.interface = interface
+        self.snapshot = self.read()
+        super().__init__()
+
+    def read(self) -> str:
+        with open(ROUTE_FILE, "r") as f:
+            if self.interface is None:
+                return f.read()
+            return "".join(
+                line for line in f if line.split("\t", 1)[0] == self.interface
+            )
+
+    def wait(self, timeout: float) -> bool:
+        deadline = monotonic() + timeout
+        while True:
+            try:
+                current = self.read()
+            except OSError:
+                current = ""
+            if current != self.snapshot:
+                self.snapshot = current
+                return True
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return False
+            if self.sleep(min(config.ROUTE_POLL_INTERVAL, remaining)):
+                return True
+
+
+class TimerEventSource(NetworkEventSource):
+    """Never observes any change, used where the kernel cannot be queried."""
+
+    name = "timer"
+
+    def wait(self, timeout: float) -> bool:
+        return self.sleep(timeout)
+
+
+class ManualEventSource(NetworkEventSource):
+    """Reports a change whenever trigger() is called, e.g. from tests."""
+
+    name = "manual"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.event = threading.Event()
+
+    def trigger(self) -> None:
+        self.event.set()
+
+    def wake(self) -> None:
+        self.trigger()
+
+    def wait(self, timeout: float) -> bool:
+        changed = self.event.wait(max(timeout, 0))
+        self.event.clear()
+        return changed
+
+
+class NetworkWatcher:
+    """
+    Waits for network changes so the run loop can probe the captive portal
+    as soon as something happens instead of on a fixed interval. Given an
+    interface, only changes to that interface are reported.
+    """
+
+    def __init__(
+        self,
+        source: Optional[NetworkEventSource] = None,
+        interface: Optional[str] = None,
+    ) -> None:
+        self.source = (
+            source if source is not None else NetworkWatcher.default_source(interface)
+        )
+        on = f" on {interface}" if interface else ""
+        info(f"Watching network changes{on} using: {self.source.name}")
+
+    @staticmethod
+    def default_source(interface: Optional[str] = None) -> NetworkEventSource:
+        for source_cls in (RtnetlinkEventSource, ProcRouteEventSource):
+            try:
+                return source_cls(interface)
+            except (OSError, AttributeError) as e:
+                debug(f"Network event source {source_cls.name} unavailable: {e}")
+        return TimerEventSource()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Blocks until the network changes or the timeout elapses. Events are
+        coalesced until the network has been quiet for EVENT_SETTLE_DELAY,
+        bounded so that a noisy source cannot stall the caller.
+        Returns:
+            bool: True if the network changed or wake() was called.
+        """
+        if not self.source.wait(timeout):
+            return False
+        deadline = monotonic() + 5 * config.EVENT_SETTLE_DELAY
+        while monotonic() < deadline and self.source.wait(config.EVENT_SETTLE_DELAY):
+            pass
+        return True
+
+    def wake(self) -> None:
+        """Makes the current or next wait() return at once, from any thread."""
+        self.source.wake()
+
+    def close(self) -> None:
+        self.source.close()
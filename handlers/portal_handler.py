@@ -1,10 +1,19 @@
 import re
-import bs4
-import requests
+from requests import Response
 from requests.exceptions import RequestException
 from urllib.parse import urljoin
 from logging import error, info
-from typing import Tuple, Dict, Optional
+from typing import Callable, Tuple, Dict, Optional
+
+from handlers.breaker_handler import PortalServerError
+from handlers.form_handler import FormCacheHandler, LoginFormExtractor
+from handlers.http_handler import HttpHandler
+from handlers.metrics_handler import MetricsHandler
+from handlers.probe_handler import ProbeHandler, ProbeState
+
+LOGIN_RESULT_PATTERN = re.compile(
+    r'Authentication Failed|http://([^/]+)/keepalive\?([^"]+)'
+)
 
 
 class PortalHandler:
@@ -15,39 +24,68 @@ class PortalHandler:
         Raises:
             RequestException: If there is an error fetching the captive portal.
         """
-        try:
-            resp = requests.get("http://clients3.google.com/generate_204", timeout=5)
-        except RequestException as e:
-            error(f"Error fetching captive portal: {e}")
-            raise e
+        result = ProbeHandler.probe()
+        if result.state == ProbeState.OFFLINE:
+            error("Error fetching captive portal: no probe endpoint answered.")
+            raise RequestException("No probe endpoint answered.")
 
-        if resp.status_code == 204:
+        if result.state == ProbeState.ONLINE:
             info("Connected to the internet, no captive portal.")
             return None
 
-        redirect_url = re.search(r'window\.location="([^"]+)"', resp.text)
-        assert redirect_url is not None
-        info(f"Redirect URL found: {redirect_url.group(1)}")
-        return redirect_url.group(1)
+        info(f"Redirect URL found: {result.redirect_url}")
+        return result.redirect_url
 
     @staticmethod
     def get_login_form(url: str) -> Tuple[str, str]:
         """
         Raises:
             RequestException: If there is an error fetching the login page.
+            PortalServerError: If the portal answers with a server error.
         """
         try:
-            resp = requests.get(url, timeout=5)
+            resp = HttpHandler.get(url)
+            PortalHandler.check_status(resp)
         except RequestException as e:
             error(f"Error fetching login page: {e}")
             raise e
         return resp.text, resp.url
 
+    @staticmethod
+    def check_status(resp: Response) -> None:
+        """
+        Raises:
+            PortalServerError: If the portal answered with a server error.
+        """
+        if resp.status_code >= 500:
+            resp.close()
+            raise PortalServerError(f"Portal answered with status {resp.status_code}.")
+
     @staticmethod
     def parse_login_form(html: str) -> Tuple[str, Dict[str, str]]:
         """
-        Extracts the form action and the hidden input fields from the login page HTML.
+        Extracts the form action and the hidden input fields from the login page HTML,
+        using the parser engine selected by config.FORM_PARSER.
         """
+        import config
+
+        if config.FORM_PARSER == "bs4":
+            action, data = PortalHandler.parse_login_form_bs4(html)
+        else:
+            action, data = PortalHandler.parse_login_form_stream(html)
+        info(f"Parsed form action: {action}")
+        return action, data
+
+    @staticmethod
+    def parse_login_form_stream(html: str) -> Tuple[str, Dict[str, str]]:
+        extractor = LoginFormExtractor()
+        extractor.feed(html)
+        return extractor.result()
+
+    @staticmethod
+    def parse_login_form_bs4(html: str) -> Tuple[str, Dict[str, str]]:
+        import bs4
+
         soup = bs4.BeautifulSoup(html, "html.parser")
         form = soup.find("form")
         assert isinstance(form, bs4.Tag)
@@ -61,7 +99,6 @@ class PortalHandler:
                 value = input_tag.get("value", "")
                 if isinstance(name, str) and name and isinstance(value, str):
                     data[name] = value
-        info(f"Parsed form action: {action}")
         return action, data
 
     @staticmethod
@@ -75,6 +112,7 @@ class PortalHandler:
         """
         Raises:
             RequestException: If there is an error submitting the login form.
+            PortalServerError: If the portal answers with a server error.
             ValueError: If authentication fails.
         """
 
@@ -89,37 +127,69 @@ class PortalHandler:
         )
 
         try:
-            resp = requests.post(post_url, data=form_data, timeout=5)
+            resp = HttpHandler.post(post_url, data=form_data, stream=True)
+            PortalHandler.check_status(resp)
+            result, text = HttpHandler.search(resp, LOGIN_RESULT_PATTERN)
         except RequestException as e:
             error(f"Error submitting login form: {e}")
             raise e
 
-        if re.search("Authentication Failed", resp.text):
+        if result is not None and result.group(0) == "Authentication Failed":
             error(f"Authentication failed for user: {username}.")
             raise ValueError("Authentication failed. Please check your credentials.")
 
         info(f"Successfully logged in.")
-        return resp.text
+        return text
 
     @staticmethod
-    def login_to_portal(username: str, password: str) -> Optional[str]:
+    def login_to_portal(
+        username: str, password: str, ready: Optional[Callable[[str], None]] = None
+    ) -> Optional[str]:
         """
+        Args:
+            ready: Called with the redirect url once the portal is found, before
+                anything is sent to it.
         Raises:
             RequestException: If there is an error with the login requests.
             ValueError: If no credentials are provided and none are found.
         """
 
         # 1) Trigger captive portal
-        url = PortalHandler.trigger_captive_portal()
+        with MetricsHandler.span("probe"):
+            url = PortalHandler.trigger_captive_portal()
         if url is None:  # No captive portal detected
             return None
-
-        # 2) Get the login form
-        login_html, login_url = PortalHandler.get_login_form(url)
-        form_action, form_data = PortalHandler.parse_login_form(login_html)
-
-        # 3) Perform login
-        login_response = PortalHandler.login(
-            login_url, form_action, form_data, username, password
-        )
+        if ready is not None:
+            ready(url)
+
+        # 2) Try the cached login form template, skipping the login page
+        template = FormCacheHandler.get(url)
+        if template is not None:
+            post_url, form_data = template
+            try:
+                with MetricsHandler.span("login_post"):
+                    login_response = PortalHandler.login(
+                        url, post_url, form_data, username, password
+                    )
+            except ValueError:
+                # A stale hidden field fails like bad credentials; only a
+                # rejection of the freshly fetched form below says they are
+                login_response = ""
+            if "/keepalive?" in login_response:
+                return login_response
+            info("Cached login form template is stale, fetching the login form.")
+            FormCacheHandler.evict(url)
+
+        # 3) Get the login form
+        with MetricsHandler.span("get_login_form"):
+            login_html, login_url = PortalHandler.get_login_form(url)
+        with MetricsHandler.span("parse_login_form"):
+            form_action, form_data = PortalHandler.parse_login_form(login_html)
+        FormCacheHandler.learn(url, login_url, form_action, form_data)
+
+        # 4) Perform login
+        with MetricsHandler.span("login_post"):
+            login_response = PortalHandler.login(
+                login_url, form_action, dict(form_data), username, password
+            )
         return login_response
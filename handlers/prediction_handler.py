@@ -0,0 +1,148 @@
+from dataclasses import asdict, dataclass
+from time import time
+from logging import info
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import config
+from handlers.journal_handler import Event, JournalHandler
+from handlers.link_handler import LinkHandler
+
+
+@dataclass
+class Prediction:
+    lifetime: float  # seconds a session lasts after login
+    confidence: float  # 0 to 1
+    samples: int  # sessions learned from
+    started_at: Optional[float] = None  # unix time of the live session's login
+    expires_at: Optional[float] = None  # unix time the live session should end
+
+    @property
+    def confident(self) -> bool:
+        return self.confidence >= config.SESSION_MIN_CONFIDENCE
+
+
+class SessionPredictor:
+    """
+    Learns how long portal sessions last from the journal, so the run loop
+    can keep the session alive and watch for its end just before it is due
+    instead of noticing at the next regular probe.
+
+    A session lasts from a successful login to the first captive probe or
+    rejected keepalive after it. Its lifetime is only known to lie between
+    the last sign of life (an online probe or accepted keepalive) and that
+    detection. For a portal with a fixed schedule the longest lower bound is
+    the tightest estimate that never overshoots; each watched session that
+    outlives it raises it further. The confidence is the share of sessions
+    that ended no earlier than the watch would have started.
+    """
+
+    CACHE: Dict[Optional[str], Tuple[Any, Optional[Prediction]]] = {}
+
+    @staticmethod
+    def sessions(
+        events: Iterable[Dict[str, Any]],
+    ) -> Tuple[List[Tuple[float, float]], Optional[float]]:
+        """
+        Returns:
+            The (lower, upper) lifetime bounds of the ended sessions, oldest
+            first, and the login time of the live session, if any.
+        """
+        lifetimes: List[Tuple[float, float]] = []
+        started_at: Optional[float] = None
+        alive_at = 0.0
+        for event in events:
+            kind, at = event["e"], event["t"]
+            if kind == Event.LOGIN and event.get("result") == "logged_in":
+                started_at = alive_at = at
+            elif started_at is None:
+                continue
+            elif (kind == Event.PROBE and event.get("state") == "online") or (
+                kind == Event.KEEPALIVE and event.get("result") == "ok"
+            ):
+                alive_at = at
+            elif (kind == Event.PROBE and event.get("state") == "captive") or (
+                kind == Event.KEEPALIVE and event.get("result") == "rejected"
+            ):
+                if alive_at > started_at:
+                    lifetimes.append((alive_at - started_at, at - started_at))
+                started_at = None
+            elif kind in (Event.LOGOUT, Event.NETWORK):
+                started_at = None  # ended by us, says nothing about the portal
+            elif kind == Event.CLOCK:
+                started_at = None  # unknown time passed, or the times are off
+        return lifetimes, started_at
+
+    @staticmethod
+    def predict() -> Optional[Prediction]:
+        """
+        Returns:
+            The prediction from the journal's ring buffer, or None before any
+            session has ended.
+        """
+        link = LinkHandler.current()
+        with JournalHandler.LOCK:
+            events = list(JournalHandler.EVENTS)
+        key = (len(events), events[-1]["t"] if events else None)
+        cached = SessionPredictor.CACHE.get(link)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        events = [event for event in events if event.get("link") == link]
+
+        lifetimes, started_at = SessionPredictor.sessions(events)
+        lifetimes = lifetimes[-config.SESSION_HISTORY_SIZE :]
+        prediction = None
+        if lifetimes:
+            lifetime = max(lower for lower, _ in lifetimes)
+            caught = sum(
+                1
+                for _, upper in lifetimes
+                if upper >= lifetime - config.SESSION_PREDICTION_LEAD
+            )
+            confidence = (
+                min(len(lifetimes) / config.SESSION_MIN_SAMPLES, 1)
+                * caught
+                / len(lifetimes)
+            )
+            prediction = Prediction(
+                lifetime=lifetime,
+                confidence=round(confidence, 2),
+                samples=len(lifetimes),
+                started_at=started_at,
+                expires_at=started_at + lifetime if started_at is not None else None,
+            )
+            if cached is None or cached[1] != prediction:
+                on = f" on {link}" if link is not None else ""
+                info(
+                    f"Prediction{on}: sessions last {lifetime:.0f}s"
+                    f" (confidence {confidence:.2f}, {len(lifetimes)} sessions)."
+                )
+        SessionPredictor.CACHE[link] = (key, prediction)
+        return prediction
+
+    @staticmethod
+    def as_dict() -> Optional[Dict[str, Any]]:
+        prediction = SessionPredictor.predict()
+        return asdict(prediction) if prediction is not None else None
+
+    @staticmethod
+    def time_until_watch() -> float:
+        """
+        Returns:
+            Seconds until the run loop should next check the session: every
+            SESSION_WATCH_INTERVAL from SESSION_PREDICTION_LEAD before the
+            predicted expiry until as long after it, otherwise infinity.
+        """
+        prediction = SessionPredictor.predict()
+        if (
+            prediction is None
+            or not prediction.confident
+            or prediction.expires_at is None
+        ):
+            return float("inf")
+        now = time()
+        watch_from = prediction.expires_at - config.SESSION_PREDICTION_LEAD
+        if now < watch_from:
+            return watch_from - now
+        if now < prediction.expires_at + config.SESSION_PREDICTION_LEAD:
+            return config.SESSION_WATCH_INTERVAL
+        return float("inf")
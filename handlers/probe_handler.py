@@ -0,0 +1,149 @@
+import re
+import threading
+from dataclasses import dataclass
+from queue import Empty, Queue
+from time import monotonic
+from requests import Response
+from requests.exceptions import ConnectionError, RequestException, Timeout
+from logging import debug, info
+from typing import List, Optional
+
+import config
+from handlers.http_handler import HttpHandler
+from handlers.link_handler import LinkHandler
+from handlers.session_handler import SessionHandler
+
+REDIRECT_PATTERN = re.compile(r'window\.location="([^"]+)"')
+
+
+class ProbeState:
+    ONLINE = "online"
+    CAPTIVE = "captive"
+    OFFLINE = "offline"
+
+
+@dataclass
+class ProbeResult:
+    state: str
+    url: str  # endpoint that answered, or the last one tried
+    elapsed: float  # seconds
+    redirect_url: Optional[str] = None
+
+
+@dataclass
+class ProbeEndpoint:
+    url: str
+    # The stored portal session is alive if the response echoes its token
+    token: Optional[str] = None
+
+
+class ProbeHandler:
+    """
+    Races several connectivity check endpoints and returns the first
+    conclusive answer, so detection is as fast as the fastest endpoint.
+    """
+
+    @staticmethod
+    def endpoints() -> List[ProbeEndpoint]:
+        endpoints = [ProbeEndpoint(url) for url in config.PROBE_URLS]
+        details = SessionHandler.read_session_details()
+        if details is not None:
+            ip, token = details
+            endpoints.append(ProbeEndpoint(f"http://{ip}/keepalive?{token}", token))
+        return endpoints
+
+    @staticmethod
+    def check(
+        endpoint: ProbeEndpoint,
+        cancelled: threading.Event,
+        responses: Optional[List[Response]] = None,
+    ) -> Optional[ProbeResult]:
+        """
+        Args:
+            responses: Collects the response, so that it can be closed if
+                another endpoint answers first.
+        Returns:
+            The result if the endpoint gave a conclusive answer, else None.
+        Raises:
+            RequestException: If the endpoint could not be reached.
+        """
+        start = monotonic()
+        try:
+            resp = HttpHandler.get_session().get(
+                endpoint.url, timeout=config.PROBE_TIMEOUT, stream=True
+            )
+        except (ConnectionError, Timeout) as e:
+            # As HttpHandler.request does, unless another endpoint answered,
+            # which shows the pooled connections still work
+            if not cancelled.is_set():
+                HttpHandler.reset()
+            raise e
+        if responses is not None:
+            responses.append(resp)
+        if cancelled.is_set():
+            resp.close()
+            return None
+        if endpoint.token is None and resp.status_code == 204:
+            resp.content
+            resp.close()
+            return ProbeResult(ProbeState.ONLINE, endpoint.url, monotonic() - start)
+
+        pattern = REDIRECT_PATTERN
+        if endpoint.token is not None:
+            pattern = re.compile(f"{REDIRECT_PATTERN.pattern}|{re.escape(endpoint.token)}")
+        match, _ = HttpHandler.search(resp, pattern)
+        elapsed = monotonic() - start
+        if match is None:
+            debug(f"Inconclusive probe answer from {endpoint.url}.")
+            return None
+        if match.group(1) is None or (
+            endpoint.token is not None and endpoint.token in match.group(1)
+        ):
+            return ProbeResult(ProbeState.ONLINE, endpoint.url, elapsed)
+        return ProbeResult(ProbeState.CAPTIVE, endpoint.url, elapsed, match.group(1))
+
+    @staticmethod
+    def probe(endpoints: Optional[List[ProbeEndpoint]] = None) -> ProbeResult:
+        """Probes all endpoints concurrently, the first conclusive answer wins."""
+        if endpoints is None:
+            endpoints = ProbeHandler.endpoints()
+        start = monotonic()
+        cancelled = threading.Event()
+        answers: "Queue[Optional[ProbeResult]]" = Queue()
+        responses: List[Response] = []
+        link = LinkHandler.current()
+
+        def worker(endpoint: ProbeEndpoint) -> None:
+            try:
+                with LinkHandler.use(link):
+                    answers.put(ProbeHandler.check(endpoint, cancelled, responses))
+            except Exception as e:
+                # Reading a response closed under it fails in various ways
+                if not isinstance(e, RequestException) and not cancelled.is_set():
+                    raise e
+                debug(f"Probe of {endpoint.url} failed: {e}")
+                answers.put(None)
+
+        # Daemon threads, so a losing endpoint never delays the process exit
+        for endpoint in endpoints:
+            threading.Thread(target=worker, args=(endpoint,), daemon=True).start()
+
+        result = None
+        try:
+            for _ in endpoints:
+                remaining = start + config.PROBE_TIMEOUT - monotonic()
+                result = answers.get(timeout=max(remaining, 0))
+                if result is not None:
+                    break
+        except Empty:
+            pass
+        cancelled.set()
+        # Frees the connections of the losing endpoints still being read
+        for resp in list(responses):
+            resp.close()
+
+        if result is None:
+            url = endpoints[-1].url if endpoints else ""
+            result = ProbeResult(ProbeState.OFFLINE, url, monotonic() - start)
+        info(f"Probe: {result.state} via {result.url} in {result.elapsed:.2f}s")
+        return result
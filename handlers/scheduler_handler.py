@@ -0,0 +1,115 @@
+import random
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass, field
+from time import time
+from logging import info
+from typing import Deque, Dict, Optional, Tuple, Type
+
+import config
+from config import SCHEDULER_HISTORY_SIZE
+
+
+class Outcome:
+    """Outcomes of a run loop iteration, fed to the scheduler."""
+
+    ONLINE = "online"
+    LOGGED_IN = "logged_in"
+    UNREACHABLE = "unreachable"  # network down or portal unreachable
+    AUTH_FAILED = "auth_failed"
+    ERROR = "error"
+    NETWORK_CHANGED = "network_changed"
+
+
+@dataclass
+class Decision:
+    outcome: str
+    delay: float  # seconds until the next probe
+    failures: int  # consecutive failures so far
+    reason: str
+    at: float = field(default_factory=time)
+
+
+class Scheduler(ABC):
+    """Decides how long the run loop waits before probing again."""
+
+    name = "base"
+
+    def __init__(self) -> None:
+        self.failures = 0
+        self.decisions: Deque[Decision] = deque(maxlen=SCHEDULER_HISTORY_SIZE)
+
+    @property
+    def last(self) -> Optional[Decision]:
+        return self.decisions[-1] if self.decisions else None
+
+    def decide(self, outcome: str) -> Decision:
+        if outcome in (Outcome.ONLINE, Outcome.LOGGED_IN, Outcome.NETWORK_CHANGED):
+            self.failures = 0
+        else:
+            self.failures += 1
+        delay, reason = self.delay(outcome)
+        decision = Decision(outcome, delay, self.failures, reason)
+        self.decisions.append(decision)
+        info(f"Scheduler: {outcome}, next check in {delay:.1f}s ({reason}).")
+        return decision
+
+    @abstractmethod
+    def delay(self, outcome: str) -> Tuple[float, str]:
+        """
+        Returns:
+            The seconds until the next probe after the outcome, and why.
+        """
+
+
+class FixedScheduler(Scheduler):
+    """Probes every CHECK_INTERVAL regardless of the outcome."""
+
+    name = "fixed"
+
+    def delay(self, outcome: str) -> Tuple[float, str]:
+        if outcome == Outcome.NETWORK_CHANGED:
+            return 0, "network changed"
+        return config.CHECK_INTERVAL, "fixed interval"
+
+
+class AdaptiveScheduler(Scheduler):
+    """
+    Idles while online, retries quickly after a transient failure and then
+    backs off exponentially with jitter while the failures persist.
+    """
+
+    name = "adaptive"
+
+    def __init__(self, rng: Optional[random.Random] = None) -> None:
+        super().__init__()
+        self.rng = rng if rng is not None else random.Random()
+
+    def backoff(self, base: float, exponent: int) -> float:
+        delay = min(base * 2 ** max(exponent, 0), config.SCHEDULER_BACKOFF_MAX)
+        # Equal jitter: keep at least half the delay, randomise the rest
+        return delay / 2 + self.rng.uniform(0, delay / 2)
+
+    def delay(self, outcome: str) -> Tuple[float, str]:
+        if outcome == Outcome.NETWORK_CHANGED:
+            return 0, "network changed"
+        if outcome == Outcome.ONLINE:
+            return config.IDLE_CHECK_INTERVAL, "online"
+        if outcome == Outcome.LOGGED_IN:
+            return config.CHECK_INTERVAL, "verifying login"
+        if outcome == Outcome.AUTH_FAILED:
+            # Retrying bad credentials quickly only risks a lockout
+            return (
+                self.backoff(config.CHECK_INTERVAL, self.failures - 1),
+                "authentication backoff",
+            )
+        if self.failures <= config.SCHEDULER_FAST_RETRIES:
+            return config.SCHEDULER_FAST_RETRY_INTERVAL, "fast retry"
+        exponent = self.failures - config.SCHEDULER_FAST_RETRIES - 1
+        return self.backoff(config.SCHEDULER_BACKOFF_BASE, exponent), "backoff"
+
+
+SCHEDULERS: Dict[str, Type[Scheduler]] = {
+    FixedScheduler.name: FixedScheduler,
+    AdaptiveScheduler.name: AdaptiveScheduler,
+}
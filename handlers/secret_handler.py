@@ -1,31 +1,152 @@
+import atexit
+import fcntl
 import json
-from logging import error, info
-from typing import List, Tuple, TYPE_CHECKING
+import os
+import tempfile
+import threading
+from time import monotonic
+from logging import debug, error, info
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar, TYPE_CHECKING
 
-from config import SECRET_LABEL, SECRET_FILE
+import config
+from config import (
+    SECRET_LABEL,
+    SECRET_FILE,
+    SECRET_LOCK_FILE,
+    CREDENTIALS_STAMP_FILE,
+)
 
 if TYPE_CHECKING:
     import secretstorage
+    from jeepney.io.blocking import DBusConnection
+
+T = TypeVar("T")
+
+
+class CredentialCache:
+    """
+    In-process, in-memory cache of retrieved credentials.
+
+    Entries, and the list of stored users, expire after CREDENTIALS_CACHE_TTL
+    and are dropped as soon as the credentials stamp file is touched by an
+    add or delete in any process.
+    """
+
+    ENTRIES: Dict[str, Tuple[float, Tuple[str, str]]] = {}
+    USERS: Optional[Tuple[float, List[str]]] = None
+    STAMP: Optional[int] = None
+
+    @staticmethod
+    def read_stamp() -> Optional[int]:
+        try:
+            return CREDENTIALS_STAMP_FILE.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def fresh(entry: Optional[Tuple[float, T]]) -> Optional[T]:
+        if CredentialCache.read_stamp() != CredentialCache.STAMP:
+            CredentialCache.clear()
+            return None
+        if entry is None or monotonic() - entry[0] > config.CREDENTIALS_CACHE_TTL:
+            return None
+        return entry[1]
+
+    @staticmethod
+    def get(username: str) -> Optional[Tuple[str, str]]:
+        return CredentialCache.fresh(CredentialCache.ENTRIES.get(username))
+
+    @staticmethod
+    def put(username: str, credentials: Tuple[str, str]) -> None:
+        if not CredentialCache.ENTRIES and CredentialCache.USERS is None:
+            CredentialCache.STAMP = CredentialCache.read_stamp()
+        CredentialCache.ENTRIES[username] = (monotonic(), credentials)
+
+    @staticmethod
+    def users() -> Optional[List[str]]:
+        return CredentialCache.fresh(CredentialCache.USERS)
+
+    @staticmethod
+    def put_users(users: List[str]) -> None:
+        if not CredentialCache.ENTRIES and CredentialCache.USERS is None:
+            CredentialCache.STAMP = CredentialCache.read_stamp()
+        CredentialCache.USERS = (monotonic(), users)
+
+    @staticmethod
+    def clear() -> None:
+        CredentialCache.ENTRIES.clear()
+        CredentialCache.USERS = None
+        CredentialCache.STAMP = CredentialCache.read_stamp()
+
+    @staticmethod
+    def invalidate() -> None:
+        """Drops the cached credentials of this and every other process."""
+        CREDENTIALS_STAMP_FILE.touch()
+        CredentialCache.clear()
 
 
 class SecretHandlerSecretStorage:
+    CONNECTION: Optional["DBusConnection"] = None
+    LOCK = threading.RLock()
+
+    @staticmethod
+    def get_connection() -> "DBusConnection":
+        import secretstorage
+
+        if SecretHandlerSecretStorage.CONNECTION is None:
+            SecretHandlerSecretStorage.CONNECTION = secretstorage.dbus_init()
+            atexit.register(SecretHandlerSecretStorage.close)
+            debug("Secret service connection opened.")
+        return SecretHandlerSecretStorage.CONNECTION
+
+    @staticmethod
+    def close() -> None:
+        with SecretHandlerSecretStorage.LOCK:
+            if SecretHandlerSecretStorage.CONNECTION is not None:
+                SecretHandlerSecretStorage.CONNECTION.close()
+                SecretHandlerSecretStorage.CONNECTION = None
+                atexit.unregister(SecretHandlerSecretStorage.close)
+                debug("Secret service connection closed.")
 
     @staticmethod
     def get_secret_collection() -> "secretstorage.Collection":
         import secretstorage
 
-        bus = secretstorage.dbus_init()
-        collection = secretstorage.get_default_collection(bus)
+        connection = SecretHandlerSecretStorage.get_connection()
+        collection = secretstorage.get_default_collection(connection)
         if collection.is_locked():
             collection.unlock()
         return collection
 
+    @staticmethod
+    def call(operation: Callable[["secretstorage.Collection"], T]) -> T:
+        """
+        Runs an operation on the default collection over the shared connection,
+        reconnecting once if the connection turns out to be broken.
+        """
+        from secretstorage.exceptions import SecretServiceNotAvailableException
+
+        with SecretHandlerSecretStorage.LOCK:
+            try:
+                return operation(SecretHandlerSecretStorage.get_secret_collection())
+            except (OSError, EOFError, SecretServiceNotAvailableException) as e:
+                info(f"Secret service connection lost, reconnecting: {e}")
+                SecretHandlerSecretStorage.close()
+            try:
+                return operation(SecretHandlerSecretStorage.get_secret_collection())
+            except (OSError, EOFError, SecretServiceNotAvailableException) as e:
+                SecretHandlerSecretStorage.close()
+                raise e
+
     @staticmethod
     def store_user_credentials(username: str, password: str) -> None:
-        collection = SecretHandlerSecretStorage.get_secret_collection()
         attrs = {"service": SECRET_LABEL, "username": username}
-        collection.create_item(SECRET_LABEL, attrs, password.encode(), replace=True)
-        collection.connection.close()
+        SecretHandlerSecretStorage.call(
+            lambda collection: collection.create_item(
+                SECRET_LABEL, attrs, password.encode(), replace=True
+            )
+        )
+        CredentialCache.invalidate()
         info(f"Stored credentials for user: {username}")
 
     @staticmethod
@@ -34,29 +155,41 @@ class SecretHandlerSecretStorage:
         Raises:
             ValueError: If no credentials are found for the given username.
         """
-        collection = SecretHandlerSecretStorage.get_secret_collection()
-        try:
-            item = next(
-                collection.search_items({"service": SECRET_LABEL, "username": username})
-            )
-            item.delete()
-        except StopIteration:
-            error_msg = f"No credentials found for user '{username}'."
-            error(error_msg)
-            raise ValueError(error_msg)
-        finally:
-            collection.connection.close()
+
+        def delete(collection: "secretstorage.Collection") -> None:
+            try:
+                item = next(
+                    collection.search_items(
+                        {"service": SECRET_LABEL, "username": username}
+                    )
+                )
+                item.delete()
+            except StopIteration:
+                error_msg = f"No credentials found for user '{username}'."
+                error(error_msg)
+                raise ValueError(error_msg)
+
+        SecretHandlerSecretStorage.call(delete)
+        CredentialCache.invalidate()
         info(f"Deleted credentials for user: {username}")
 
     @staticmethod
     def get_all_users() -> List[str]:
-        collection = SecretHandlerSecretStorage.get_secret_collection()
-        users: List[str] = []
-        for item in collection.search_items({"service": SECRET_LABEL}):
-            attrs = item.get_attributes()
-            if "username" in attrs:
-                users.append(attrs["username"])
-        return users
+        users = CredentialCache.users()
+        if users is not None:
+            return list(users)
+
+        def search(collection: "secretstorage.Collection") -> List[str]:
+            users: List[str] = []
+            for item in collection.search_items({"service": SECRET_LABEL}):
+                attrs = item.get_attributes()
+                if "username" in attrs:
+                    users.append(attrs["username"])
+            return users
+
+        users = SecretHandlerSecretStorage.call(search)
+        CredentialCache.put_users(users)
+        return list(users)
 
     @staticmethod
     def get_user_credentials(username: str) -> Tuple[str, str]:
@@ -64,55 +197,98 @@ class SecretHandlerSecretStorage:
         Raises:
             ValueError: If no credentials are found for the given username.
         """
-        collection = SecretHandlerSecretStorage.get_secret_collection()
-        try:
-            item = next(
-                collection.search_items({"service": SECRET_LABEL, "username": username})
-            )
-            password = item.get_secret()
-        except StopIteration:
-            error_msg = f"No credentials found for user '{username}'."
-            error(error_msg)
-            raise ValueError(error_msg)
-        finally:
-            collection.connection.close()
+        credentials = CredentialCache.get(username)
+        if credentials is not None:
+            return credentials
+
+        def search(collection: "secretstorage.Collection") -> bytes:
+            try:
+                item = next(
+                    collection.search_items(
+                        {"service": SECRET_LABEL, "username": username}
+                    )
+                )
+                return item.get_secret()
+            except StopIteration:
+                error_msg = f"No credentials found for user '{username}'."
+                error(error_msg)
+                raise ValueError(error_msg)
+
+        password = SecretHandlerSecretStorage.call(search)
         info(f"Retrieved credentials for user: {username}")
-        return username, password.decode()
+        credentials = username, password.decode()
+        CredentialCache.put(username, credentials)
+        return credentials
+
+
+class SecretHandlerPlainText:
+    """
+    Credentials stored as JSON in SECRET_FILE, with an in-memory index that
+    is only reloaded when the file is replaced. Writes are serialised with a
+    lock file and replace the file atomically.
+    """
+
+    INDEX: Dict[str, str] = {}
+    FILE_ID: Optional[Tuple[int, int, int]] = None
 
     @staticmethod
-    def get_first_matching_credentials() -> Tuple[str, str]:
+    def file_id() -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(SECRET_FILE)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def load() -> Dict[str, str]:
+        file_id = SecretHandlerPlainText.file_id()
+        if file_id is None:
+            SecretHandlerPlainText.INDEX = {}
+        elif file_id != SecretHandlerPlainText.FILE_ID:
+            try:
+                with open(SECRET_FILE, "r") as f:
+                    credentials = json.load(f)
+                assert isinstance(credentials, dict)
+            except:
+                error(f"Could not read credentials from {SECRET_FILE}.")
+                credentials = {}
+            SecretHandlerPlainText.INDEX = credentials
+            debug("Credentials index loaded.")
+        SecretHandlerPlainText.FILE_ID = file_id
+        return SecretHandlerPlainText.INDEX
+
+    @staticmethod
+    def update(operation: Callable[[Dict[str, str]], None]) -> None:
         """
-        Raises:
-            ValueError: If no credentials are found for the service.
+        Applies an operation to a copy of the stored credentials and atomically
+        replaces the file with the result, holding the lock throughout.
         """
-        collection = SecretHandlerSecretStorage.get_secret_collection()
-        try:
-            item = next(collection.search_items({"service": SECRET_LABEL}))
-            username = item.get_attributes().get("username", "")
-            password = item.get_secret()
-        except StopIteration:
-            error_msg = f"No credentials found for service '{SECRET_LABEL}'."
-            error(error_msg)
-            raise ValueError(error_msg)
-        finally:
-            collection.connection.close()
-        info(f"Retrieved credentials for user: {username}")
-        return username, password.decode()
+        with open(SECRET_LOCK_FILE, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            credentials = dict(SecretHandlerPlainText.load())
+            operation(credentials)
 
+            fd, tmp_path = tempfile.mkstemp(
+                dir=SECRET_FILE.parent, prefix=f".{SECRET_FILE.name}."
+            )
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(credentials, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, SECRET_FILE)
+            except BaseException as e:
+                os.unlink(tmp_path)
+                raise e
+            SecretHandlerPlainText.INDEX = credentials
+            SecretHandlerPlainText.FILE_ID = SecretHandlerPlainText.file_id()
 
-class SecretHandlerPlainText:
     @staticmethod
     def store_user_credentials(username: str, password: str) -> None:
-        credentials = {}
-        try:
-            with open(SECRET_FILE, "r") as f:
-                credentials = json.load(f)
-        except:
-            pass
-
-        credentials[username] = password
-        with open(SECRET_FILE, "w") as f:
-            json.dump(credentials, f)
+        def store(credentials: Dict[str, str]) -> None:
+            credentials[username] = password
+
+        SecretHandlerPlainText.update(store)
         info(f"Stored credentials for user: {username}")
 
     @staticmethod
@@ -121,26 +297,18 @@ class SecretHandlerPlainText:
         Raises:
             ValueError: If no credentials are found for the given username.
         """
-        try:
-            with open(SECRET_FILE, "r") as f:
-                credentials = json.load(f)
+
+        def delete(credentials: Dict[str, str]) -> None:
             if username not in credentials:
                 raise ValueError(f"No credentials found for user '{username}'.")
             del credentials[username]
-            with open(SECRET_FILE, "w") as f:
-                json.dump(credentials, f)
-            info(f"Deleted credentials for user: {username}")
-        except:
-            raise ValueError(f"No credentials found for user '{username}'.")
+
+        SecretHandlerPlainText.update(delete)
+        info(f"Deleted credentials for user: {username}")
 
     @staticmethod
     def get_all_users() -> List[str]:
-        try:
-            with open(SECRET_FILE, "r") as f:
-                credentials = json.load(f)
-            return list(credentials.keys())
-        except:
-            return []
+        return list(SecretHandlerPlainText.load().keys())
 
     @staticmethod
     def get_user_credentials(username: str) -> Tuple[str, str]:
@@ -148,30 +316,10 @@ class SecretHandlerPlainText:
         Raises:
             ValueError: If no credentials are found for the given username.
         """
-        try:
-            with open(SECRET_FILE, "r") as f:
-                credentials = json.load(f)
-            if username not in credentials:
-                raise ValueError(f"No credentials found for user '{username}'.")
-            return username, credentials[username]
-        except:
+        credentials = SecretHandlerPlainText.load()
+        if username not in credentials:
             raise ValueError(f"No credentials found for user '{username}'.")
-
-    @staticmethod
-    def get_first_matching_credentials() -> Tuple[str, str]:
-        """
-        Raises:
-            ValueError: If no credentials are found.
-        """
-        try:
-            with open(SECRET_FILE, "r") as f:
-                credentials = json.load(f)
-            if not credentials:
-                raise ValueError(f"No credentials found.")
-            username, password = next(iter(credentials.items()))
-            return username, password
-        except:
-            raise ValueError(f"No credentials found.")
+        return username, credentials[username]
 
 
 def get_secret_handler():
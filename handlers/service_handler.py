@@ -1,15 +1,23 @@
 from pathlib import Path
 from os import getenv
 from textwrap import dedent
-import subprocess
 from logging import error, info
 from typing import Optional
 
-from config import SERVICE_NAME, SCRIPT_PATH, USER_SYSTEMD_PATH, SERVICE_FILE
-from utils import run_cmd
+from config import (
+    SERVICE_NAME,
+    SCRIPT_PATH,
+    USER_SYSTEMD_PATH,
+    SERVICE_FILE,
+    SERVICE_WATCHDOG_SEC,
+)
+from handlers.systemd_handler import SystemdBus
+
+UNIT_NAME = SERVICE_FILE.name
 
 
 class ServiceHandler:
+    BUS: Optional[SystemdBus] = None  # replaceable by a fake in tests
 
     @staticmethod
     def create() -> None:
@@ -23,8 +31,11 @@ class ServiceHandler:
             After=default.target
 
             [Service]
-            Type=simple
+            Type=notify
+            NotifyAccess=main
+            WatchdogSec={SERVICE_WATCHDOG_SEC}
             ExecStart={SCRIPT_PATH} run
+            ExecReload=/bin/kill -HUP $MAINPID
             Restart=on-failure
             RestartSec=5
             WorkingDirectory={Path.home()}
@@ -37,77 +48,98 @@ class ServiceHandler:
         SERVICE_FILE.write_text(service_content)
         info(f"Service file created at {SERVICE_FILE}")
 
+    @staticmethod
+    def bus() -> SystemdBus:
+        """
+        Raises:
+            OSError: If the systemd user manager cannot be reached.
+        """
+        if ServiceHandler.BUS is None:
+            ServiceHandler.BUS = SystemdBus()
+        return ServiceHandler.BUS
+
     @staticmethod
     def enable() -> None:
         """Enables the IIITK Portal Loginator service."""
         try:
-            run_cmd(["systemctl", "--user", "daemon-reload"])
-            _, result = run_cmd(
-                ["systemctl", "--user", "enable", SERVICE_NAME], stderr=True
-            )
-            if result:
+            bus = ServiceHandler.bus()
+            bus.reload()
+            if bus.enable(UNIT_NAME):
                 info("Service enabled successfully.")
             else:
                 info("Service already enabled.")
-        except subprocess.CalledProcessError:
-            error(f"Failed to enable service {SERVICE_NAME}. It may not be created.")
+        except (OSError, ValueError) as e:
+            error(f"Failed to enable service {SERVICE_NAME}. It may not be created. {e}")
 
     @staticmethod
     def disable() -> None:
         """Disables the IIITK Portal Loginator service."""
         try:
-            _, result = run_cmd(
-                ["systemctl", "--user", "disable", SERVICE_NAME], stderr=True
-            )
-            if result:
+            if ServiceHandler.bus().disable(UNIT_NAME):
                 info("Service disabled successfully.")
             else:
                 info("Service already disabled.")
-        except subprocess.CalledProcessError:
+        except (OSError, ValueError) as e:
             error(
-                f"Failed to disable service {SERVICE_NAME}. It may not be enabled or created."
+                f"Failed to disable service {SERVICE_NAME}. It may not be enabled or created. {e}"
             )
 
     @staticmethod
     def start() -> None:
         """Starts the IIITK Portal Loginator service."""
         try:
-            run_cmd(["systemctl", "--user", "start", SERVICE_NAME])
+            ServiceHandler.bus().start(UNIT_NAME)
             info(f"Service {SERVICE_NAME} started.")
-        except subprocess.CalledProcessError:
+        except (OSError, ValueError) as e:
             error(
-                f"Failed to start service {SERVICE_NAME}. It may not be enabled or created."
+                f"Failed to start service {SERVICE_NAME}. It may not be enabled or created. {e}"
             )
 
     @staticmethod
     def stop() -> None:
         """Stops the IIITK Portal Loginator service."""
         try:
-            run_cmd(["systemctl", "--user", "stop", SERVICE_NAME])
+            ServiceHandler.bus().stop(UNIT_NAME)
             info(f"Service {SERVICE_NAME} stopped.")
-        except subprocess.CalledProcessError:
-            error(f"Failed to stop service {SERVICE_NAME}. It may not be running.")
+        except (OSError, ValueError) as e:
+            error(f"Failed to stop service {SERVICE_NAME}. It may not be running. {e}")
 
     @staticmethod
     def restart() -> None:
         """Restarts the IIITK Portal Loginator service."""
         try:
-            run_cmd(["systemctl", "--user", "restart", SERVICE_NAME])
+            ServiceHandler.bus().restart(UNIT_NAME)
             info(f"Service {SERVICE_NAME} restarted.")
-        except subprocess.CalledProcessError:
+        except (OSError, ValueError) as e:
             error(
-                f"Failed to restart service {SERVICE_NAME}. It may not be running or created."
+                f"Failed to restart service {SERVICE_NAME}. It may not be running or created. {e}"
             )
 
+    @staticmethod
+    def setup() -> None:
+        """
+        Creates, enables and (re)starts the service in one batch over a single
+        connection, instead of stop, disable, daemon-reload, enable and start.
+        """
+        ServiceHandler.create()
+        try:
+            bus = ServiceHandler.bus()
+            bus.reload()
+            bus.enable(UNIT_NAME)
+            # Restarting stops the old instance first, if it is running
+            bus.restart(UNIT_NAME)
+            info(f"Service {SERVICE_NAME} enabled and started.")
+        except (OSError, ValueError) as e:
+            error(f"Failed to set up service {SERVICE_NAME}. {e}")
+
     @staticmethod
     def status() -> bool:
         """Checks the status of the IIITK Portal Loginator service."""
         try:
-            run_cmd(["systemctl", "--user", "is-active", "--quiet", SERVICE_NAME])
-            return True
-        except subprocess.CalledProcessError:
+            return ServiceHandler.bus().active_state(UNIT_NAME) in ("active", "reloading")
+        except (OSError, ValueError):
             return False
-    
+
     @staticmethod
     def invocation_id() -> Optional[str]:
         return getenv("INVOCATION_ID")
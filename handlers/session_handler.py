@@ -1,17 +1,37 @@
 import re
 import json
-from requests.exceptions import RequestException
+import tempfile
+import threading
+from os import fdopen, remove, replace, unlink
+from time import perf_counter
 from logging import error, info
-from typing import Tuple, Optional
+from typing import Callable, Tuple, Optional
 
-from config import TOKEN_FILE
+from config import TOKEN_FILE, LOGIN_LOCK_FILE, LOGIN_STATE_FILE
 from utils import Warp
-from handlers.portal_handler import PortalHandler
+from handlers.journal_handler import Event, JournalHandler
+from handlers.link_handler import LinkHandler
+from handlers.metrics_handler import MetricsHandler
 from handlers.secret_handler import get_secret_handler
+from handlers.single_flight_handler import SingleFlightHandler
+
+
+class LoginResult:
+    """Outcomes of SessionHandler.login."""
+
+    LOGGED_IN = "logged_in"
+    NOT_NEEDED = "not_needed"  # no captive portal
+    NO_CREDENTIALS = "no_credentials"
+    AUTH_FAILED = "auth_failed"
+    QUARANTINED = "quarantined"  # every stored account was rejected before
+    UNREACHABLE = "unreachable"
+    CIRCUIT_OPEN = "circuit_open"  # portal failing, nothing sent to it
 
 
 class SessionHandler:
 
+    TOKEN_LOCK = threading.Lock()  # batch logins save tokens from many threads
+
     @staticmethod
     def parse_session_details(html: str) -> Tuple[str, str]:
         # Response html contains a url with a keepalive token
@@ -21,54 +41,225 @@ class SessionHandler:
         token = match.group(2)
         info(f"Session - ip: {ip} token: {token}")
 
-        with open(TOKEN_FILE, "w") as f:
-            json.dump(
-                {
-                    "_comment": "This file is auto-generated by IIITK Portal Loginator",
-                    "ip": ip,
-                    "token": token,
-                },
-                f,
+        # Written aside and renamed, so readers never see a partial file. The
+        # temporary file is unique, as other processes may be saving too.
+        token_file = LinkHandler.path(TOKEN_FILE)
+        with SessionHandler.TOKEN_LOCK:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=token_file.parent, prefix=f".{token_file.name}."
             )
+            try:
+                with fdopen(fd, "w") as f:
+                    json.dump(
+                        {
+                            "_comment": "This file is auto-generated by IIITK Portal Loginator",
+                            "ip": ip,
+                            "token": token,
+                        },
+                        f,
+                    )
+                replace(tmp_path, token_file)
+            except BaseException as e:
+                unlink(tmp_path)
+                raise e
         info("Session details saved.")
 
         return ip, token
 
+    @staticmethod
+    def read_session_details() -> Optional[Tuple[str, str]]:
+        """Returns the stored session ip and token, or None without logging."""
+        try:
+            with open(LinkHandler.path(TOKEN_FILE), "r") as f:
+                data = json.load(f)
+                return data["ip"], data["token"]
+        except:
+            return None
+
     @staticmethod
     def get_session_details() -> Tuple[str, str]:
         """
         Raises:
             ValueError: If no session token is found.
         """
-        try:
-            with open(TOKEN_FILE, "r") as f:
-                data = json.load(f)
-                return data["ip"], data["token"]
-        except:
+        details = SessionHandler.read_session_details()
+        if details is None:
             error("No session token found. Please login first.")
             raise ValueError("No session token found. Please login first.")
+        return details
+
+    @staticmethod
+    def logout() -> None:
+        """
+        Raises:
+            ValueError: If no session token is found.
+            RequestException: If the logout request fails.
+        """
+        from handlers.http_handler import HttpHandler
+
+        ip, token = SessionHandler.get_session_details()
+        url = f"http://{ip}/logout?{token}"
+        info(f"Logout url: {url}")
+        HttpHandler.get(url)
+        remove(LinkHandler.path(TOKEN_FILE))
+        JournalHandler.record(Event.LOGOUT)
+        info("Logged out.")
 
     @staticmethod
     def login(
         *, username: Optional[str] = None, password: Optional[str] = None
-    ) -> None:
+    ) -> str:
+        """
+        Logs in, or joins a login of the same account (or of the stored ones
+        if None) already in progress in any process.
+        Returns:
+            str: The LoginResult of the attempt.
+        """
+
+        def operation() -> str:
+            start = perf_counter()
+            with MetricsHandler.capture() as phases:
+                result = SessionHandler.perform_login(username=username, password=password)
+            JournalHandler.record(
+                Event.LOGIN, result=result, seconds=perf_counter() - start, phases=phases
+            )
+            return result
+
+        try:
+            return SingleFlightHandler.run(
+                LinkHandler.path(LOGIN_LOCK_FILE),
+                LinkHandler.path(LOGIN_STATE_FILE),
+                operation,
+                key=username,  # logging in as someone else does not log in this one
+            )
+        except TimeoutError:
+            return LoginResult.UNREACHABLE
+
+    @staticmethod
+    def perform_login(
+        *,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        warp: bool = True,
+        ready: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """
+        Logs in with the given account, or with the first stored account that
+        is not quarantined, failing over to the next one if the portal
+        rejects it (see CircuitBreakerHandler).
+        Args:
+            warp: Whether to disconnect Warp around the login. Batches of
+                logins turn it off and do so once for the whole batch.
+            ready: Called with the portal's redirect url before logging in.
+        Returns:
+            str: The LoginResult of the attempt.
+        """
+        from handlers.breaker_handler import CircuitBreakerHandler
+
         try:
             if username is None:
-                username, password = get_secret_handler().get_first_matching_credentials()
+                usernames = get_secret_handler().get_all_users()
+                if not usernames:
+                    raise ValueError("No credentials found.")
             elif password is None:
                 username, password = get_secret_handler().get_user_credentials(username)
         except ValueError as e:
             error(e)
-            return
+            return LoginResult.NO_CREDENTIALS
+
+        try:
+            if warp:
+                # Overlaps the Warp disconnect with the portal probe
+                Warp.disconnect(wait=False)
+            if username is not None:
+                return SessionHandler.attempt_login(username, password, warp, ready)
+
+            result = LoginResult.QUARANTINED
+            for username in usernames:
+                try:
+                    username, password = get_secret_handler().get_user_credentials(
+                        username
+                    )
+                except ValueError:
+                    continue  # deleted meanwhile
+                if not CircuitBreakerHandler.account_allowed(username, password):
+                    continue
+                result = SessionHandler.attempt_login(username, password, warp, ready)
+                if result != LoginResult.AUTH_FAILED:
+                    return result
+                info(f"Login rejected for {username}, trying the next account.")
+            if result == LoginResult.QUARANTINED:
+                error("All stored accounts are quarantined after rejected logins.")
+            return result
+        finally:
+            if warp:
+                with MetricsHandler.span("warp_restore"):
+                    Warp.restore()
+
+    @staticmethod
+    def attempt_login(
+        username: str,
+        password: str,
+        warp: bool,
+        ready: Optional[Callable[[str], None]],
+    ) -> str:
+        """
+        Logs in with one account, through the portal's circuit breakers.
+        Returns:
+            str: The LoginResult of the attempt.
+        """
+        from requests.exceptions import RequestException
+        from handlers.breaker_handler import CircuitBreakerHandler, CircuitOpenError
+        from handlers.http_handler import DnsCache
+        from handlers.portal_handler import PortalHandler
+
+        portal_url: Optional[str] = None
+        failure: Optional[str] = None
+        rejected: Optional[bool] = None
+        local_error = False  # e.g. Warp or the token file, says nothing of the portal
+
+        def portal_found(url: str) -> None:
+            nonlocal portal_url
+            CircuitBreakerHandler.check_portal(url)
+            portal_url = url
+            if warp:
+                with MetricsHandler.span("warp_disconnect"):
+                    Warp.wait()
+            if ready is not None:
+                ready(url)
 
         try:
-            Warp.disconnect()
-            login_response = PortalHandler.login_to_portal(username, password)
+            login_response = PortalHandler.login_to_portal(
+                username, password, ready=portal_found
+            )
             if login_response is None:
-                return None
+                return LoginResult.NOT_NEEDED
 
             SessionHandler.parse_session_details(login_response)
-        except (RequestException, ValueError):
-            pass
+            rejected = False
+            # Answers given behind the portal may have been intercepted
+            DnsCache.clear()
+            return LoginResult.LOGGED_IN
+        except CircuitOpenError as e:
+            error(e)
+            return LoginResult.CIRCUIT_OPEN
+        except RequestException as e:
+            failure = CircuitBreakerHandler.classify(e)
+            return LoginResult.UNREACHABLE
+        except ValueError:
+            rejected = True
+            return LoginResult.AUTH_FAILED
+        except AssertionError as e:
+            failure = CircuitBreakerHandler.classify(e)  # an unusable page
+            raise e
+        except Exception as e:
+            local_error = True
+            raise e
         finally:
-            Warp.restore()
+            if portal_url is None:
+                pass
+            elif local_error:
+                CircuitBreakerHandler.portal_release(portal_url)
+            else:
+                CircuitBreakerHandler.portal_done(portal_url, failure)
+            CircuitBreakerHandler.account_done(username, password, rejected)
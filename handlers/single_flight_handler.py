@@ -0,0 +1,97 @@
+import fcntl
+import json
+import os
+from pathlib import Path
+from time import monotonic, sleep
+from logging import error, info
+from typing import Any, Callable, Dict, Optional
+
+import config
+from handlers.link_handler import LinkHandler
+from handlers.systemd_handler import SystemdNotifier
+
+
+class SingleFlightHandler:
+    """
+    Cross-process single-flight: while one process runs an operation, the
+    same operation requested by any other process or thread waits for it and
+    receives its result instead of running again.
+
+    Each operation has a lock file, held while it runs, and a state file with
+    a generation counter, the last result and the key of the request it
+    answered, replaced atomically. A result is only shared with requests of
+    the same key, e.g. logins of the same account.
+    """
+
+    @staticmethod
+    def read_state(state_path: Path) -> Dict[str, Any]:
+        try:
+            with open(state_path, "r") as f:
+                state = json.load(f)
+            return {
+                "generation": int(state["generation"]),
+                "result": state["result"],
+                "key": state.get("key"),
+            }
+        except:
+            return {"generation": 0, "result": None, "key": None}
+
+    @staticmethod
+    def write_state(
+        state_path: Path, generation: int, result: Any, key: Optional[str] = None
+    ) -> None:
+        tmp_path = state_path.with_name(f".{state_path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"generation": generation, "result": result, "key": key}, f)
+        os.replace(tmp_path, state_path)
+
+    @staticmethod
+    def acquire(lock: Any) -> bool:
+        """
+        Waits up to SINGLE_FLIGHT_TIMEOUT for the lock, which may be longer
+        than the systemd watchdog allows, so the wait counts as a sign of life.
+        """
+        deadline = monotonic() + config.SINGLE_FLIGHT_TIMEOUT
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if monotonic() >= deadline:
+                    return False
+                SystemdNotifier.watchdog(LinkHandler.current())
+                sleep(0.1)
+
+    @staticmethod
+    def run(
+        lock_path: Path,
+        state_path: Path,
+        operation: Callable[[], Any],
+        key: Optional[str] = None,
+    ) -> Any:
+        """
+        Runs the operation, or joins the run already in progress for the same key.
+        Raises:
+            TimeoutError: If the run in progress does not finish in time.
+        """
+        seen = SingleFlightHandler.read_state(state_path)["generation"]
+        with open(lock_path, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                info(f"Waiting for the {lock_path.stem} already in progress...")
+                if not SingleFlightHandler.acquire(lock):
+                    error_msg = f"Timed out waiting for the {lock_path.stem} in progress."
+                    error(error_msg)
+                    raise TimeoutError(error_msg)
+
+            state = SingleFlightHandler.read_state(state_path)
+            if state["generation"] > seen and state["key"] == key:
+                info(f"Joined the {lock_path.stem} in progress: {state['result']}")
+                return state["result"]
+
+            result = operation()
+            SingleFlightHandler.write_state(
+                state_path, state["generation"] + 1, result, key
+            )
+            return result
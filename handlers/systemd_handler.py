@@ -0,0 +1,194 @@
+import os
+import socket
+import threading
+from time import monotonic
+from logging import debug, error
+from typing import Any, Iterable, Optional, Set, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from jeepney import Message
+
+SYSTEMD_BUS_NAME = "org.freedesktop.systemd1"
+SYSTEMD_PATH = "/org/freedesktop/systemd1"
+MANAGER_INTERFACE = "org.freedesktop.systemd1.Manager"
+UNIT_INTERFACE = "org.freedesktop.systemd1.Unit"
+
+
+class SystemdBus:
+    """
+    Client for the systemd user manager over D-Bus, replacing one
+    `systemctl --user` process per operation with calls on one connection.
+
+    Any object with jeepney's `send_and_get_reply(message)` can stand in for
+    the connection, so the manager can be faked in tests.
+    """
+
+    def __init__(self, connection: Any = None) -> None:
+        """
+        Raises:
+            OSError: If the session bus cannot be reached.
+        """
+        if connection is None:
+            from jeepney.io.blocking import open_dbus_connection
+
+            try:
+                connection = open_dbus_connection(bus="SESSION")
+            except (KeyError, RuntimeError) as e:
+                # No DBUS_SESSION_BUS_ADDRESS, e.g. over SSH or from cron
+                raise OSError(f"No session bus: {e}")
+        self.connection = connection
+
+    def close(self) -> None:
+        close = getattr(self.connection, "close", None)
+        if close is not None:
+            close()
+
+    def call(
+        self,
+        method: str,
+        signature: Optional[str] = None,
+        body: Tuple = (),
+        path: str = SYSTEMD_PATH,
+        interface: str = MANAGER_INTERFACE,
+    ) -> Tuple:
+        """
+        Returns:
+            The body of the reply.
+        Raises:
+            ValueError: If systemd returns an error.
+            OSError: If the connection is broken.
+        """
+        from jeepney import DBusAddress, DBusErrorResponse, new_method_call
+        from jeepney.wrappers import unwrap_msg
+
+        address = DBusAddress(path, bus_name=SYSTEMD_BUS_NAME, interface=interface)
+        message = new_method_call(address, method, signature, body)
+        reply: "Message" = self.connection.send_and_get_reply(message)
+        try:
+            return unwrap_msg(reply)
+        except DBusErrorResponse as e:
+            raise ValueError(f"{method}: {e.name}: {' '.join(map(str, e.data))}")
+
+    def reload(self) -> None:
+        self.call("Reload")
+
+    def enable(self, unit: str) -> bool:
+        """
+        Returns:
+            bool: Whether any symlinks were changed.
+        """
+        _, changes = self.call("EnableUnitFiles", "asbb", ([unit], False, True))
+        return bool(changes)
+
+    def disable(self, unit: str) -> bool:
+        """
+        Returns:
+            bool: Whether any symlinks were changed.
+        """
+        (changes,) = self.call("DisableUnitFiles", "asb", ([unit], False))
+        return bool(changes)
+
+    def start(self, unit: str) -> None:
+        self.call("StartUnit", "ss", (unit, "replace"))
+
+    def stop(self, unit: str) -> None:
+        self.call("StopUnit", "ss", (unit, "replace"))
+
+    def restart(self, unit: str) -> None:
+        self.call("RestartUnit", "ss", (unit, "replace"))
+
+    def active_state(self, unit: str) -> str:
+        (path,) = self.call("LoadUnit", "s", (unit,))
+        ((_, state),) = self.call(
+            "Get",
+            "ss",
+            (UNIT_INTERFACE, "ActiveState"),
+            path=path,
+            interface="org.freedesktop.DBus.Properties",
+        )
+        return state
+
+
+class SystemdNotifier:
+    """
+    sd_notify(3) without libsystemd: readiness, status and watchdog pings
+    for a Type=notify unit. Does nothing when not started by systemd.
+    """
+
+    WATCHDOG_INTERVAL: Optional[float] = None
+    NEXT_WATCHDOG_AT: float = float("inf")
+    LOOPS: Set[Optional[str]] = {None}  # loops that must beat before each ping
+    BEATS: Set[Optional[str]] = set()
+    LOCK = threading.Lock()
+
+    @staticmethod
+    def notify(state: str) -> bool:
+        """
+        Returns:
+            bool: Whether the message was sent.
+        """
+        address = os.getenv("NOTIFY_SOCKET")
+        if not address:
+            return False
+        if address.startswith("@"):
+            address = "\0" + address[1:]  # abstract namespace
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+                sock.sendto(state.encode(), address)
+            return True
+        except OSError as e:
+            error(f"Could not notify systemd: {e}")
+            return False
+
+    @staticmethod
+    def ready() -> None:
+        if SystemdNotifier.notify("READY=1"):
+            debug("Notified systemd: ready.")
+        watchdog_usec = os.getenv("WATCHDOG_USEC")
+        watchdog_pid = os.getenv("WATCHDOG_PID")
+        if watchdog_usec and (not watchdog_pid or int(watchdog_pid) == os.getpid()):
+            # Pings twice per timeout, as sd_watchdog_enabled(3) recommends
+            SystemdNotifier.WATCHDOG_INTERVAL = int(watchdog_usec) / 1e6 / 2
+            SystemdNotifier.NEXT_WATCHDOG_AT = monotonic()
+
+    @staticmethod
+    def status(text: str) -> None:
+        SystemdNotifier.notify(f"STATUS={text}")
+
+    @staticmethod
+    def stopping() -> None:
+        SystemdNotifier.notify("STOPPING=1")
+
+    @staticmethod
+    def watch(loops: Iterable[Optional[str]]) -> None:
+        """Sets the loops that must all call watchdog() for the service to live."""
+        with SystemdNotifier.LOCK:
+            SystemdNotifier.LOOPS = set(loops)
+            SystemdNotifier.BEATS.clear()
+
+    @staticmethod
+    def time_until_watchdog(loop: Optional[str] = None) -> float:
+        remaining = max(SystemdNotifier.NEXT_WATCHDOG_AT - monotonic(), 0)
+        if remaining == 0 and loop in SystemdNotifier.BEATS:
+            # Due, but waiting on another loop, which pings when it beats
+            return SystemdNotifier.WATCHDOG_INTERVAL / 4
+        return remaining
+
+    @staticmethod
+    def watchdog(loop: Optional[str] = None) -> None:
+        """
+        Records that the loop is not stuck, and pings the watchdog if it is
+        due and every loop has done so since the last ping.
+        """
+        if SystemdNotifier.WATCHDOG_INTERVAL is None:
+            return
+        with SystemdNotifier.LOCK:
+            SystemdNotifier.BEATS.add(loop)
+            if monotonic() < SystemdNotifier.NEXT_WATCHDOG_AT:
+                return
+            if not SystemdNotifier.LOOPS <= SystemdNotifier.BEATS:
+                return
+            SystemdNotifier.notify("WATCHDOG=1")
+            SystemdNotifier.BEATS.clear()
+            interval = SystemdNotifier.WATCHDOG_INTERVAL
+            SystemdNotifier.NEXT_WATCHDOG_AT = monotonic() + interval
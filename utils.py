@@ -1,7 +1,12 @@
+import shutil
 import subprocess
+import threading
+from time import monotonic, perf_counter
 from logging import error, info, debug
 from typing import overload, List, Tuple, Union, Optional
 
+import config
+
 
 @overload
 def run_cmd(cmd: List[str]) -> str:
@@ -46,33 +51,159 @@ def run_cmd(
 
 
 class Warp:
+    """
+    Controls Cloudflare Warp around logins. Whether warp-cli exists is
+    detected once, its state is cached for WARP_STATE_TTL, and the disconnect
+    can run in the background while the portal is being probed.
+
+    Warp is one tunnel for the whole system while logins run per interface,
+    so it is reference counted: the first login to disconnect it does so,
+    and the last one to restore it reconnects it.
+    """
+
+    USERS: int = 0  # logins between disconnect() and restore()
+    LOCK = threading.Lock()
     WAS_ON: bool = False
+    AVAILABLE: Optional[bool] = None
+    STATE: Optional[bool] = None
+    STATE_AT: float = 0.0
+    PENDING: Optional[threading.Thread] = None
+    PENDING_ERROR: Optional[Exception] = None
+    RESTORED: Optional[threading.Event] = None  # set once the last restore is done
+    SUBPROCESS_TIME: float = 0.0  # seconds spent in warp-cli for the current login
+
+    @staticmethod
+    def available() -> bool:
+        if Warp.AVAILABLE is None:
+            Warp.AVAILABLE = shutil.which("warp-cli") is not None
+            if not Warp.AVAILABLE:
+                info("Warp CLI is not installed, skipping Warp.")
+        return Warp.AVAILABLE
+
+    @staticmethod
+    def run(args: List[str]) -> str:
+        """
+        Raises:
+            subprocess.CalledProcessError: If warp-cli fails.
+        """
+        from handlers.metrics_handler import MetricsHandler
+
+        start = perf_counter()
+        try:
+            return run_cmd(["warp-cli", *args])
+        finally:
+            elapsed = perf_counter() - start
+            Warp.SUBPROCESS_TIME += elapsed
+            MetricsHandler.observe("warp_subprocess", elapsed)
+
+    @staticmethod
+    def set_state(connected: bool) -> None:
+        Warp.STATE = connected
+        Warp.STATE_AT = monotonic()
+
+    @staticmethod
+    def invalidate() -> None:
+        """Forgets the cached state, e.g. after the network has changed."""
+        Warp.STATE = None
 
     @staticmethod
     def status() -> bool:
+        if not Warp.available():
+            return False
+        if (
+            Warp.STATE is not None
+            and monotonic() - Warp.STATE_AT < config.WARP_STATE_TTL
+        ):
+            return Warp.STATE
         try:
-            out = run_cmd(["warp-cli", "status"])
+            out = Warp.run(["status"])
             status = "Connected" in out or "Connecting" in out
             info(f"Warp Connected: {status}")
         except:
-            error("Warp CLI is not installed or not available.")
+            error("Warp CLI is not available.")
             status = False
+        Warp.set_state(status)
         return status
 
     @staticmethod
-    def disconnect() -> None:
-        Warp.WAS_ON = Warp.status()
-        if Warp.WAS_ON:
-            info("Disconnecting Warp...")
-            run_cmd(["warp-cli", "disconnect"])
+    def disconnect(*, wait: bool = True) -> None:
+        """
+        Disconnects Warp if it is on, remembering its state for restore(),
+        unless another login already has. With wait=False it runs in the
+        background until wait() is called.
+        """
+
+        def disconnect(restored: Optional[threading.Event]) -> None:
+            # A restore still reconnecting must finish before the state is read
+            if restored is not None:
+                restored.wait()
+            try:
+                Warp.WAS_ON = Warp.status()
+                if Warp.WAS_ON:
+                    info("Disconnecting Warp...")
+                    Warp.run(["disconnect"])
+                    Warp.set_state(False)
+            except Exception as e:
+                Warp.PENDING_ERROR = e
+
+        with Warp.LOCK:
+            Warp.USERS += 1
+            if Warp.USERS == 1:
+                Warp.SUBPROCESS_TIME = 0.0
+                Warp.PENDING = threading.Thread(
+                    target=disconnect, args=(Warp.RESTORED,), daemon=True
+                )
+                Warp.PENDING.start()
+        if wait:
+            Warp.wait()
+
+    @staticmethod
+    def wait() -> None:
+        """
+        Waits for a background disconnect to finish.
+        Raises:
+            subprocess.CalledProcessError: If the disconnect failed.
+        """
+        # Kept until the last restore(), for every login sharing the disconnect
+        pending = Warp.PENDING
+        if pending is not None:
+            pending.join()
+        if Warp.PENDING_ERROR is not None:
+            raise Warp.PENDING_ERROR
 
     @staticmethod
     def connect() -> None:
         info("Connecting Warp...")
-        run_cmd(["warp-cli", "connect"])
+        Warp.run(["connect"])
+        Warp.set_state(True)
 
     @staticmethod
     def restore() -> None:
-        info(f"Restoring Warp to: Connected: {Warp.WAS_ON}")
-        if Warp.WAS_ON:
-            Warp.connect()
+        """
+        Reconnects Warp if it was on, once the last login using it is done.
+        Raises:
+            subprocess.CalledProcessError: If the disconnect or connect failed.
+        """
+        # Decided under the lock, while warp-cli runs outside it, so that
+        # other links are not held up by the subprocess
+        with Warp.LOCK:
+            Warp.USERS = max(Warp.USERS - 1, 0)
+            if Warp.USERS > 0:
+                debug(f"Warp stays off for {Warp.USERS} more logins.")
+                return
+            pending, Warp.PENDING = Warp.PENDING, None
+            restored = Warp.RESTORED = threading.Event()
+
+        try:
+            if pending is not None:
+                pending.join()
+            e, Warp.PENDING_ERROR = Warp.PENDING_ERROR, None
+            if e is not None:
+                raise e
+            info(f"Restoring Warp to: Connected: {Warp.WAS_ON}")
+            if Warp.WAS_ON:
+                Warp.connect()
+            if Warp.available():
+                info(f"Warp added {Warp.SUBPROCESS_TIME:.2f}s of subprocess time.")
+        finally:
+            restored.set()